@@ -9,6 +9,31 @@ Though this is done in pursuit of clarity:
 
 
 
+def asynch_getter(unsent, groupsize_limit=None, DBG=True):
+    """
+    Parameters
+    ----------
+    unsent: generator-prepared requests objects that are not yet responses
+    groupsize_limit: can keep us from spamming web server. 12-at-a-time works
+
+    Returns
+    -------
+    flat list of 'response' objects from each URL contained in unsent
+    """
+    if groupsize_limit is None:
+        groupsize_limit = len(unsent)
+    d = []
+    while unsent:
+        bunch = []
+        groupsize = min(len(unsent), groupsize_limit)
+        for x in xrange(groupsize):
+            bunch.append(unsent.pop())
+        if DBG:
+            print("requesting from {} urls".format(groupsize))
+        d.extend(grequests.map(bunch))
+    return d
+
+
 def dct_hint2(im, hsize=32):
     """ doesn't give the same results due to some undercover type coercion, and is a hair slower"""
     q = mpz()
@@ -98,3 +123,145 @@ def mean_dct(ups, downs):
     dndn = np.mean(np.vstack(downvsdown))
     print(allup, updown, dndn)
     return allup, updown, dndn
+
+
+def needed_faces(cardmap, examine_zeros=False):
+    """
+    filter cardmap to include only items that need examination for faces.
+    defaults to only examining 'null' valued, new items, not zeroes.
+    """
+    needed = {}
+    for id, cardpath in cardmap.viewitems():
+        if manifest.present(cardpath):
+            card_has_face = orient_db.cur.execute("SELECT face FROM orient WHERE id=?", (id,)).fetchone()[0]
+            if card_has_face is None or (examine_zeros and not card_has_face):
+                needed[id] = cardmap[id]
+    return needed
+
+
+def find_faces(cardmap, scale=1.25, min_neighbor=4):
+    """
+    Parameters
+    ----------
+    cardmap: {database id: local/path/to/pic, ...}
+
+    Returns
+    -------
+    counter object showing the quantity of examined pics with a given number of faces detected.
+    side-effect: database column 'face' gets updated with quantity of faces found.
+    """
+    facecount = Counter()
+    if not cardmap:
+        print("All face detection was done previously")
+        return facecount
+    print("face finder will examine {} pictures, using scale={} minNeighbors={}"
+          .format(len(cardmap), scale, min_neighbor))
+    face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+    for n, (id, cardpath) in enumerate(cardmap.viewitems()):
+        faces = face_cascade.detectMultiScale(cv2.equalizeHist(cv2.imread(cardpath, cv2.IMREAD_GRAYSCALE)),
+                                              scaleFactor=scale, minNeighbors=min_neighbor)
+        face_quant = len(faces)
+        if face_quant:
+            print("{}: {}: has {} face{}".format(n, cardpath, face_quant, 's' if face_quant > 1 else ''))
+        facecount[face_quant] += 1
+        orient_db.cur.execute("UPDATE orient SET face=(?) WHERE id=(?)", (face_quant, id))
+    orient_db.con.commit()
+    return facecount
+
+
+def add_dct_data(cardpaths):
+    """
+    sock away top and bottom dcts of pics as a persistent 64-bit int
+    cardpaths = {card['id']: os.path.join(__local_dir__, card['pic_path']), card['id']: None, ...}
+    cardpaths should be drawn from card_db where they are already vetted
+    """
+    datas = []
+    counter = 0
+    print("Calculating DCT data for {} items...".format(len(cardpaths)))
+    for idc, fsp in cardpaths.viewitems():
+        #id, top_dct, picpath, face
+        current_card = orient_db.cur.execute("SELECT id, top_dct FROM orient WHERE id=(?)", (idc,)).fetchone()
+        #print "AFF", fsp, current_card
+        if fsp and not current_card['top_dct']:
+            counter += 1
+            if not (counter % 200):
+                print("{} new pics dct'd".format(counter))
+            shortpath = os.path.sep.join(fsp.split(os.path.sep)[-2:])
+            im = cv2.equalizeHist(cv2.imread(fsp, cv2.IMREAD_GRAYSCALE))
+            try:
+                flim = im[::-1, ::-1]
+                height, width = im.shape[:2]
+                top, bot = dct_hints([im[:int(width * __RAT__), :], flim[:int(width * __RAT__), :]])
+                datas.append({'id': idc, 'picpath': shortpath, 'top_dct': str(top), 'bot_dct': str(bot)})
+            except TypeError as e:
+                print("{} No picture was loaded for path: {}".format(e, fsp))
+    print("{} new pics dct'd".format(counter))
+    print("adding {} new lines of data to orient from {} card-paths".format(len(datas), len(cardpaths)))
+    if datas:
+        orient_db.add_data(datas, 'orient', 'id')
+        print("committed!")
+
+    q = orient_db.cur.execute("SELECT id FROM orient").fetchall()
+    print("there are now {} lines in orient".format(len(q)))
+    return datas
+
+
+def akazer(pics=None, akaze=None, columns='ak_points,ak_desc'):
+    """
+    Not just for AKAZE any more!
+
+    Parameters
+    ----------
+    pics = {id: local-path-to-pic, ...}
+    akaze = cv2.AKAZE_create() or cv2.ORB_create() or cv2.KAZE_create() etc..
+    columns = two comma separated column names for the new data
+    Returns
+    -------
+    list of image data formatted for entering into cards database
+    """
+    new_data = []
+    if pics is None:
+        pics = cards()
+    if akaze is None:
+        akaze = cv2.AKAZE_create()
+    c1, c2 = columns.split(',')
+    for kk, vv in pics.viewitems():
+        if vv:
+            im = cv2.imread(vv)
+        else:
+            im = None
+        if im is not None:
+            akps, adesc = akaze.detectAndCompute(im, None)
+            jk = [(a.pt, a.angle, a.class_id, a.octave, a.response, a.size) for a in akps]
+            new_data.append({'id': kk, c1: jk, c2: Binary(adesc.dumps())})
+        else:
+            print("for id: {}, akazer failed to find pic on path: {}".format(kk, vv))
+    return new_data
+
+
+def run_akazer(workchunk=100, db=orient_db, dbtable='orient', columns='ak_points,ak_desc', fs=peep.__mtgpics__):
+    pntcol, desc_col = columns.split(',')
+    ADD_COLUMNS = False
+    current_columns = db.show_columns(dbtable)
+    if (pntcol not in current_columns) or (desc_col not in current_columns):
+        ADD_COLUMNS = True
+        needed = db.cur.execute("SELECT id, picpath FROM {} WHERE picpath IS NOT NULL"
+                                .format(dbtable)).fetchmany(size=workchunk)
+    else:
+        needed = db.cur.execute("SELECT id, picpath FROM {} WHERE picpath IS NOT NULL and {} IS NULL"
+                                .format(dbtable, pntcol)).fetchmany(size=workchunk)
+        # remove missing paths
+    cardstack = {}
+    for want in needed:
+        full_path = os.path.join(fs, want['picpath'])
+        if manifest.present(full_path, fs=fs):
+            cardstack[want['id']] = full_path
+    if not cardstack:
+        print("finished adding keypoint and descriptor data")
+        return 0
+    with Timer(msg="processing {} new items".format(len(cardstack))):
+        dataa = akazer(pics=cardstack, columns=columns)
+        if ADD_COLUMNS:
+            db.tracker(dbtable).learn(dataa)
+        db.add_data(dataa, dbtable, key_column='id')
+    return 1
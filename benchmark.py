@@ -0,0 +1,199 @@
+#!/usr/bin/env python -S
+# -*- coding: utf-8 -*-
+"""
+times the stages of populate.py's import against made-up mtgjson sets in a throwaway directory,
+so it never touches the real databases or the network.
+
+>> python benchmark.py                     the default sizes and sparsities
+>> python benchmark.py 1000 50000 0.2 0.8  card counts (whole numbers) and sparsities (fractions) of your choosing
+
+Sparsity is the fraction of the optional card columns each card leaves out. Every size/sparsity runs in a fresh
+process, and the results are added to benchmark_results.json, along with how each stage compares to the previous
+run with the same settings. A stage's memory is how far it grew the process's resident size, at its highest,
+above where it stood when the stage began.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+import sqlite3
+
+__results__ = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results.json')
+__sizes__ = [1000, 10000, 100000, 500000]
+__sparsities__ = [0.2, 0.8]
+__per_set__ = 250           # cards in each made-up set
+__optional__ = 40           # made-up card columns, beyond the ones every card has
+__seed__ = 1993
+__sample_s__ = 0.02         # seconds between looks at the resident size while a stage runs
+__stages__ = ['generate', 'json_dump', 'deckify', 'column_type_parser', 'hash_rows', 'add_data', 'add_data_again',
+              'main_archive', 'main_archive_unchanged']
+
+
+def fake_card(rnd, code, i, sparsity):
+    """ one mtgjson-looking card; each optional column shows up with probability 1 - sparsity """
+    card = {u'id': u'{}-{:06d}'.format(code, i), u'name': u'Card {} of {}'.format(i, code),
+            u'number': unicode(i), u'layout': u'normal', u'imageName': u'card {}'.format(i),
+            u'type': rnd.choice([u'Creature', u'Instant', u'Sorcery', u'Land']),
+            u'text': u' '.join(rnd.choice([u'tap', u'draw', u'flying', u'target', u'mana']) for _ in xrange(25)),
+            u'cmc': rnd.randint(0, 9), u'colors': rnd.sample([u'W', u'U', u'B', u'R', u'G'], rnd.randint(1, 2)),
+            u'legalities': [{u'format': u'Legacy', u'legality': u'Legal'}],
+            u'foreignNames': [{u'language': u'Deutsch', u'name': u'Karte {}'.format(i)}]}
+    for k in xrange(__optional__):
+        if rnd.random() >= sparsity:
+            card[u'opt{:02d}'.format(k)] = [rnd.random(), u'x' * (k % 7), k, [k], {u'k': k}][k % 5]
+    return card
+
+
+def fake_sets(cards, sparsity, seed=__seed__):
+    """ list of made-up sets holding 'cards' cards in all """
+    rnd, sets = random.Random(seed), []
+    for n in xrange(0, cards, __per_set__):
+        code = u'Z{:04d}'.format(n // __per_set__)
+        sets.append({u'code': code, u'name': u'Fake set {}'.format(code), u'releaseDate': u'1993-08-05',
+                     u'type': u'expansion', u'booster': [u'common'] * 10,
+                     u'cards': [fake_card(rnd, code, i, sparsity) for i in xrange(n, min(n + __per_set__, cards))]})
+    return sets
+
+
+def rss_mb():
+    """
+    this process's resident size right now, from /proc (linux). Elsewhere it falls back on the high-water mark
+    (osx reports bytes), so a stage only shows what it adds beyond the biggest of the stages before it.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as fob:
+            return int(fob.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+class Grown(object):
+    """ with Grown() as g: ... then g.mb is how far the resident size rose above its starting point, at most """
+    def __enter__(self):
+        self.base = self.top = rss_mb()
+        self.running = True
+        self.watch = threading.Thread(target=self.sample, name='rss')
+        self.watch.daemon = True
+        self.watch.start()
+        return self
+
+    def sample(self):
+        while self.running:
+            self.top = max(self.top, rss_mb())
+            time.sleep(__sample_s__)
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.watch.join()
+        self.top = max(self.top, rss_mb())
+        self.mb = self.top - self.base
+
+
+def run_one(cards, sparsity):
+    """
+    times each stage (in __stages__ order) in the current directory, which should be an empty, throwaway one.
+    Returns: {stage: {'seconds':, 'rows':, 'rows_per_s':, 'grew_mb':}, ...}, grew_mb being the stage's memory growth
+    """
+    import populate as peep     # only now, so its database files land in the throwaway directory
+    peep.DEBUG = False
+    peep.set_db.DB_DEBUG = peep.card_db.DB_DEBUG = False
+    stages = {}
+
+    def timed(stage, rows, fn, *args, **kwargs):
+        with Grown() as memory:
+            start = time.time()
+            result = fn(*args, **kwargs)
+            elapsed = max(time.time() - start, 1e-6)
+        stages[stage] = {'seconds': round(elapsed, 4), 'rows': rows, 'rows_per_s': round(rows / elapsed, 1),
+                         'grew_mb': round(memory.mb, 1)}
+        return result
+
+    sets = timed('generate', cards, fake_sets, cards, sparsity)
+    with open('AllSets.json', 'wb') as fob:
+        timed('json_dump', cards, json.dump, dict((s[u'code'], s) for s in sets), fob)
+    deck = timed('deckify', cards, peep.deckify, sets)
+    timed('column_type_parser', cards, peep.column_type_parser, deck, exclusions=peep.__cards_hdr_excluded__)
+    timed('hash_rows', cards, map, peep.hash_rows, sets)
+    bench_db = peep.DBMagic(DBfn=os.path.abspath('bench' + peep.__sqlext__),
+                            DBcolumns={peep.__cards_t__: peep.createstr.format(peep.__cards_t__, peep.__cards_key__)})
+    bench_db.tracker(peep.__cards_t__, exclusions=peep.__cards_hdr_excluded__).learn(deck)
+    bench_db.add_columns(peep.__cards_t__, {peep.__hash_col__: 'TEXT'})
+    timed('add_data', cards, bench_db.add_data, deck, peep.__cards_t__, key_column=peep.__cards_key__)
+    timed('add_data_again', cards, bench_db.add_data, deck, peep.__cards_t__, key_column=peep.__cards_key__)
+    del sets, deck
+    timed('main_archive', cards, peep.main, archive='AllSets.json')
+    timed('main_archive_unchanged', cards, peep.main, archive='AllSets.json')
+    return stages
+
+
+def spawn(cards, sparsity):
+    """ run_one() in a child process, inside a temporary directory that is deleted afterwards """
+    workdir = tempfile.mkdtemp(prefix='cardsnake_bench_')
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--one', str(cards), str(sparsity)],
+                                      cwd=workdir, env=dict(os.environ, PYTHONPATH=os.pathsep.join(
+                                          [here, os.environ.get('PYTHONPATH', '')])))
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def previous(history, cards, sparsity):
+    """ (version, stages) of the latest saved run with the same settings, or (None, {}) """
+    for run in reversed(history):
+        for r in run['results']:
+            if r['cards'] == cards and r['sparsity'] == sparsity:
+                return run['version'], r['stages']
+    return None, {}
+
+
+def main(sizes=None, sparsities=None, fn=__results__):
+    try:
+        with open(fn, 'rb') as fob:
+            history = json.load(fob)
+    except (IOError, ValueError):
+        history = []
+    run = {'when': time.strftime('%Y-%m-%d %H:%M:%S'), 'version': version(), 'python': sys.version.split()[0],
+           'sqlite': sqlite3.sqlite_version, 'results': []}
+    for cards in sizes or __sizes__:
+        for sparsity in sparsities or __sparsities__:
+            print("\n{} cards, sparsity {}".format(cards, sparsity))
+            stages = spawn(cards, sparsity)
+            was, before = previous(history, cards, sparsity)
+            for stage in [s for s in __stages__ if s in stages]:
+                r, change = stages[stage], ""
+                if stage in before:
+                    change = "{:+.0%} rows/s vs {}".format(r['rows_per_s'] / before[stage]['rows_per_s'] - 1, was)
+                print("{:>24}: {:>9.3f}s {:>12,.0f} rows/s  grew {:>8.1f} MB  {}"
+                      .format(stage, r['seconds'], r['rows_per_s'], r['grew_mb'], change))
+            run['results'].append({'cards': cards, 'sparsity': sparsity, 'stages': stages})
+    history.append(run)
+    with open(fn, 'wb') as fob:
+        json.dump(history, fob, indent=1, sort_keys=True)
+    print("\nsaved results to: {}".format(fn))
+    return 1
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--one']:
+        print(json.dumps(run_one(int(sys.argv[2]), float(sys.argv[3]))))
+        exit(0)
+    numbers = sys.argv[1:]
+    exit(main(sizes=[int(a) for a in numbers if '.' not in a] or None,
+              sparsities=[float(a) for a in numbers if '.' in a] or None))
@@ -10,6 +10,8 @@ import orientation, seemore
 from collections import namedtuple, defaultdict
 import os
 import pricer
+import manifest
+import packstore
 
 Card = namedtuple('Card', 'name, code, id, pic_path, kp')
 
@@ -86,9 +88,10 @@ def undertaker(db=orientation.orient_db, path_front=orientation.peep.__mtgpics__
     on their given path. Allows user to simply delete unwanted add-on pics from where they are
     in the local file-system.
     """
+    manifest.refresh(path_front)
     bad_user_stuff = [line['id'] for line in
                      db.cur.execute("SELECT id, pic_path FROM cards WHERE code=?", (img_code,)).fetchall()
-                     if not os.path.isfile(os.path.join(path_front, line['pic_path']))]
+                     if not manifest.present(line['pic_path'], fs=path_front)]
     print("user stuff without pictures: {}".format(len(bad_user_stuff)))
     for tbl in ['orient', 'cards']:
         db.cur.executemany("DELETE FROM {} WHERE id=?".format(tbl), ((b,) for b in bad_user_stuff))
@@ -159,13 +162,13 @@ def main():
                         pricestr = ", ".join(map(str, pricestr)[1:3])
                     if not DRAW_MATCHES:
                         cv2.imshow("{} {}".format(one_card.name, one_card.code),
-                                   cv2.imread(os.path.join(pathfront, one_card.pic_path)))
+                                   packstore.imread(os.path.join(pathfront, one_card.pic_path)))
                         if PRINT_GOOD: print("good match: {} {}  (pnts:{})  prices: {}"
                                              .format(cardlist[indx].name, cardlist[indx].code, len(matches), pricestr))
                     else:
                         cv2.imshow("{} {}".format(one_card.name, one_card.code),
                                    cv2.drawMatchesKnn(samp_img, current_kp,
-                                                      cv2.imread(os.path.join(pathfront, one_card.pic_path)),
+                                                      packstore.imread(os.path.join(pathfront, one_card.pic_path)),
                                                       one_card.kp, matches, outImg=np.zeros((yc, xc*2, 3),
                                                                                             dtype=np.uint8),
                                                       flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS))
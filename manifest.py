@@ -0,0 +1,163 @@
+#!/usr/bin/env python -S
+# -*- coding: utf-8 -*-
+"""
+a manifest of the pictures under /pics/ kept in the cards database: path, size, mtime and a sha1 of the contents.
+
+Stages ask the manifest whether a picture is there instead of each doing an os.stat() per card,
+calling refresh() once at their start when files may have come or gone since.
+refresh() brings it up to date by listing just the set directories whose own mtime has changed
+(adding, removing or renaming a file inside one changes it), and only hashes the files that are new or changed.
+A directory whose mtime was too close to the listing to tell a later change apart (FAT and SD cards keep mtimes
+to 2 seconds) is listed again next time. A file overwritten in place doesn't touch its directory's mtime, so
+that goes unnoticed until a refresh(force=True) (or 'python manifest.py') compares every file's size and mtime.
+Anything that writes a picture itself can note() it right away.
+
+Paths in the manifest are relative to the pictures folder, /pics/. Any other folder's are kept whole (see key()).
+
+scandir (built in from python 3.5, or 'pip install scandir' for 2.7) makes the listing faster, but isn't required.
+"""
+import os
+import stat
+import hashlib
+import time
+import populate as peep
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__min_size__ = 10   # bytes a picture file must beat to count as good
+__mtime_slack__ = 2.0   # seconds: a directory mtime this close to its listing might hide a later change
+
+manifest_db = peep.DBMagic(DBfn=peep.__sqlcards__,
+                           DBcolumns={'manifest': '''CREATE TABLE manifest (path TEXT PRIMARY KEY, size INTEGER,
+                                      mtime REAL, hash TEXT)''',
+                                      'manifest_dirs': '''CREATE TABLE manifest_dirs (dir TEXT PRIMARY KEY,
+                                      mtime REAL)'''},
+                           DB_DEBUG=True)
+
+_sizes = {}         # {fs: {relative path: size}} for every file in the manifest, once fs has been refreshed
+
+
+def relative(fn, fs=peep.__mtgpics__):
+    """ 'fs/ISD/isd2.jpg' and 'ISD/isd2.jpg' both come back as 'ISD/isd2.jpg' """
+    fs = os.path.join(fs, '')
+    return fn[len(fs):] if fn.startswith(fs) else fn
+
+
+def root(fs=peep.__mtgpics__):
+    """ what goes in front of a relative path to make its manifest key: nothing for /pics/, all of 'fs' otherwise """
+    fs = os.path.abspath(fs)
+    return '' if fs == os.path.abspath(peep.__mtgpics__) else os.path.join(fs, '')
+
+
+def key(fn, fs=peep.__mtgpics__):
+    """ the manifest's path for picture 'fn' (full, or relative to 'fs') """
+    return root(fs) + relative(fn, fs)
+
+
+def mine(k, fs=peep.__mtgpics__):
+    """ is manifest key 'k' (of a file or a directory) from folder 'fs'? """
+    front = root(fs)
+    return k.startswith(front) and not os.path.isabs(k[len(front):])
+
+
+def file_hash(fn, content=None):
+    if content is None:
+        with open(fn, 'rb') as fob:
+            content = fob.read()
+    return hashlib.sha1(content).hexdigest()
+
+
+def listing(folder):
+    """ {file name: (size, mtime)} for the files in one directory, using scandir when it's around """
+    found = {}
+    if scandir is not None:
+        for e in scandir(folder):
+            if e.is_file():
+                st = e.stat()
+                found[e.name] = (st.st_size, st.st_mtime)
+        return found
+    for name in os.listdir(folder):
+        st = os.stat(os.path.join(folder, name))
+        if stat.S_ISREG(st.st_mode):
+            found[name] = (st.st_size, st.st_mtime)
+    return found
+
+
+def inside(d):
+    """ sql condition (and its parameters) for the manifest paths inside directory 'd' """
+    return "path > ? AND path < ?", (d + os.sep, d + chr(ord(os.sep) + 1))
+
+
+def refresh(fs=peep.__mtgpics__, db=manifest_db, force=False):
+    """
+    update the manifest for every set directory under 'fs' whose mtime has changed since it was last listed.
+    force: list every directory, and compare every file's size and mtime, changed or not
+    Returns: number of files added, changed or removed
+    """
+    if not os.path.isdir(fs):
+        _sizes[fs] = {}     # no folder, no pictures
+        return 0
+    front = root(fs)
+    known_dirs = dict(r for r in db.cur.execute("SELECT dir, mtime FROM manifest_dirs").fetchall() if mine(r[0], fs))
+    dirs = {front + d: os.stat(os.path.join(fs, d)).st_mtime
+            for d in os.listdir(fs) if os.path.isdir(os.path.join(fs, d))}
+    changes = 0
+    with db.transaction() as cur:
+        for d, mtime in dirs.viewitems():
+            if not force and known_dirs.get(d) == mtime:
+                continue
+            where, params = inside(d)
+            old = {r[0]: (r[1], r[2]) for r in cur.execute("SELECT path, size, mtime FROM manifest WHERE " + where,
+                                                            params)}
+            listed = time.time()
+            new = {os.path.join(d, name): st for name, st in listing(os.path.join(fs, relative(d, front))).viewitems()}
+            gone = [(p,) for p in old if p not in new]
+            fresh = [(p, st[0], st[1], file_hash(os.path.join(fs, relative(p, front))))
+                     for p, st in new.viewitems() if old.get(p) != st]
+            cur.executemany("DELETE FROM manifest WHERE path=?", gone)
+            cur.executemany("INSERT OR REPLACE INTO manifest (path, size, mtime, hash) VALUES (?, ?, ?, ?)", fresh)
+            if abs(listed - mtime) < __mtime_slack__:
+                mtime = None    # a file added just after the listing might not have moved the mtime: look again
+            cur.execute("INSERT OR REPLACE INTO manifest_dirs (dir, mtime) VALUES (?, ?)", (d, mtime))
+            changes += len(gone) + len(fresh)
+        for d in [d for d in known_dirs if d not in dirs]:
+            where, params = inside(d)
+            changes += cur.execute("DELETE FROM manifest WHERE " + where, params).rowcount
+            cur.execute("DELETE FROM manifest_dirs WHERE dir=?", (d,))
+    if changes or fs not in _sizes:
+        _sizes[fs] = {relative(p, front): size for p, size in db.cur.execute("SELECT path, size FROM manifest")
+                      if mine(p, fs)}
+    if changes and db.DB_DEBUG:
+        print("picture manifest: {} files added, changed or removed".format(changes))
+    return changes
+
+
+def sizes(fs=peep.__mtgpics__):
+    """ {relative path: size in bytes} of all the pictures, refreshing the manifest first (once per process) """
+    if fs not in _sizes:
+        refresh(fs)
+    return _sizes[fs]
+
+
+def present(fn, fs=peep.__mtgpics__):
+    """ in place of os.path.isfile(fn) and os.stat(fn).st_size > 10, for a path under 'fs' (full or relative) """
+    return sizes(fs).get(relative(fn, fs), 0) > __min_size__
+
+
+def note(fn, content=None, fs=peep.__mtgpics__, db=manifest_db):
+    """ put one just-written picture in the manifest (content: its bytes, when they're at hand) """
+    st = os.stat(os.path.join(fs, relative(fn, fs)))
+    db.cur.execute("INSERT OR REPLACE INTO manifest (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                   (key(fn, fs), st.st_size, st.st_mtime, file_hash(os.path.join(fs, relative(fn, fs)), content)))
+    if fs in _sizes:
+        _sizes[fs][relative(fn, fs)] = st.st_size
+
+
+if __name__ == "__main__":
+    refresh(force=True)
+    print("{} pictures in the manifest".format(len(sizes())))
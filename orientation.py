@@ -6,13 +6,14 @@ generate some dct data if needed. Use it to help determine the most similar imag
 
 run populate first, then picfinder, then run orientation and wait a few minutes while new dcts are added to database
 """
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, namedtuple
 from operator import itemgetter
-import gmpy2
 from gmpy2 import mpz
 from cv2_common import *
 from sqlite3 import Binary
 import populate as peep
+import manifest
+import packstore
 import sys
 reload(sys).setdefaultencoding("utf8")
 # import cv2
@@ -21,24 +22,49 @@ reload(sys).setdefaultencoding("utf8")
 # import os
 
 __RAT__ = 0.80  # image height = __RAT__* width. This mostly puts top-image's-bottom-border at art-line
+__simfile__ = os.getcwd() + os.sep + 'simile_index.npy'   # compiled hashes & faces, for Simile to memory-map
+__simids__ = os.getcwd() + os.sep + 'simile_ids.npy'      # the card id of each column in __simfile__
 
 orient_db = peep.DBMagic(DBfn=peep.__sqlcards__,
-                         DBcolumns={'orient': peep.createstr.format('orient', peep.__cards_key__)},
+                         DBcolumns={'orient': peep.createstr.format('orient', peep.__cards_key__),
+                                    'orient_generation': '''CREATE TABLE orient_generation (generation INTEGER,
+                                    indexed INTEGER)'''},
+                         DBaddcolumns={'orient': {'top_dct': 'TEXT', 'bot_dct': 'TEXT', 'picpath': 'TEXT',
+                                                  'face': 'INTEGER'}},
+                         DBtriggers={'orient': {'orient_{}'.format(event.split()[0].lower()):
+                                                '''AFTER {} ON orient
+                                                BEGIN UPDATE orient_generation SET generation = generation + 1; END'''
+                                                .format(event)
+                                                for event in ['INSERT', 'DELETE', 'UPDATE OF top_dct, bot_dct, face']}},
                          DB_DEBUG=True)
+# the triggers: every change to the hashes or faces in 'orient' bumps the generation, so a compiled index knows
+# when it's stale. orient_generation's one row is written along with the first index (see generation())
 
-orient_db.add_columns('orient', {'top_dct': 'TEXT', 'bot_dct': 'TEXT', 'picpath': 'TEXT', 'face': 'INTEGER'})
+
+__bit_weights__ = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))    # bit i of a hash is 1 << i
+
+
+def dct_hints(ims, hsize=32):
+    """
+    the dct hashes of a bunch of grayscale images at once, as a numpy uint64 array in the same order.
+    Each image still gets its own resize and dct, but the thresholding and the packing of the 64 bits
+    happen for all of them together. Bit order is that of dct_hint(), so stored hashes stay good.
+    """
+    bumpy = np.array([cv2.dct(np.array(cv2.resize(im, dsize=(hsize, hsize), interpolation=cv2.INTER_AREA),
+                                       dtype=np.float32))[:8, 1:9] for im in ims], dtype=np.float32).reshape(-1, 64)
+    bits = bumpy > bumpy.mean(axis=1, keepdims=True)
+    return np.bitwise_or.reduce(np.where(bits, __bit_weights__, np.uint64(0)), axis=1)
 
 
 def dct_hint(im, hsize=32):
     """ returning DCT hash as 64-bit mpz int, which makes popcount faster"""
-    q = mpz()
-    bumpy = cv2.dct(np.array(cv2.resize(im, dsize=(hsize, hsize),
-                                        interpolation=cv2.INTER_AREA), dtype=np.float32))[:8, 1:9]
-    #print((bumpy>np.mean(bumpy)).ravel())
-    for i, j in enumerate((bumpy > np.mean(bumpy)).ravel()):
-        if j:
-            q += 1 << i
-    return q
+    return mpz(int(dct_hints([im], hsize=hsize)[0]))
+
+
+def top_hints(imgs):
+    """ dct hashes (uint64 array) of the tops of color frames, eg from a web-cam, the way the database pics are done """
+    return dct_hints([cv2.equalizeHist(cv2.cvtColor(img[:int(img.shape[1] * __RAT__), :], cv2.COLOR_BGR2GRAY))
+                      for img in imgs])
 
 
 @contextmanager
@@ -50,98 +76,17 @@ def Mytime(scoresheet):
         scoresheet.append(clock()-start)
 
 
-def cards(fs=peep.__mtgpics__):
+def cards(fs=peep.__mtgpics__, ids=None):
     # joins unique part of path to local path-stub or sends a None if path is None.
+    # ids: limit the map to these card ids (eg from populate.changed_cards()), or None for all
     cardmap = {}
     for line in orient_db.cur.execute("SELECT id, picpath from orient").fetchall():
         #print("fs={}   picpath={}".format(fs, line['pic_path']))
-        if line['picpath']:
+        if line['picpath'] and (ids is None or line['id'] in ids):
             cardmap[line['id']] = os.path.join(fs, line['picpath'])
     return cardmap
 
 
-def needed_faces(cardmap, examine_zeros=False):
-    """
-    filter cardmap to include only items that need examination for faces.
-    defaults to only examining 'null' valued, new items, not zeroes.
-    """
-    needed = {}
-    for id, cardpath in cardmap.viewitems():
-        if os.path.isfile(cardpath):
-            card_has_face = orient_db.cur.execute("SELECT face FROM orient WHERE id=?", (id,)).fetchone()[0]
-            if card_has_face is None or (examine_zeros and not card_has_face):
-                needed[id] = cardmap[id]
-    return needed
-
-
-def find_faces(cardmap, scale=1.25, min_neighbor=4):
-    """
-    Parameters
-    ----------
-    cardmap: {database id: local/path/to/pic, ...}
-
-    Returns
-    -------
-    counter object showing the quantity of examined pics with a given number of faces detected.
-    side-effect: database column 'face' gets updated with quantity of faces found.
-    """
-    facecount = Counter()
-    if not cardmap:
-        print("All face detection was done previously")
-        return facecount
-    print("face finder will examine {} pictures, using scale={} minNeighbors={}"
-          .format(len(cardmap), scale, min_neighbor))
-    face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
-    for n, (id, cardpath) in enumerate(cardmap.viewitems()):
-        faces = face_cascade.detectMultiScale(cv2.equalizeHist(cv2.imread(cardpath, cv2.IMREAD_GRAYSCALE)),
-                                              scaleFactor=scale, minNeighbors=min_neighbor)
-        face_quant = len(faces)
-        if face_quant:
-            print("{}: {}: has {} face{}".format(n, cardpath, face_quant, 's' if face_quant > 1 else ''))
-        facecount[face_quant] += 1
-        orient_db.cur.execute("UPDATE orient SET face=(?) WHERE id=(?)", (face_quant, id))
-    orient_db.con.commit()
-    return facecount
-
-
-def add_dct_data(cardpaths):
-    """
-    sock away top and bottom dcts of pics as a persistent 64-bit int
-    cardpaths = {card['id']: os.path.join(__local_dir__, card['pic_path']), card['id']: None, ...}
-    cardpaths should be drawn from card_db where they are already vetted
-    """
-    datas = []
-    counter = 0
-    print("Calculating DCT data for {} items...".format(len(cardpaths)))
-    for idc, fsp in cardpaths.viewitems():
-        #id, top_dct, picpath, face
-        current_card = orient_db.cur.execute("SELECT id, top_dct FROM orient WHERE id=(?)", (idc,)).fetchone()
-        #print "AFF", fsp, current_card
-        if fsp and not current_card['top_dct']:
-            counter += 1
-            if not (counter % 200):
-                print("{} new pics dct'd".format(counter))
-            shortpath = os.path.sep.join(fsp.split(os.path.sep)[-2:])
-            im = cv2.equalizeHist(cv2.imread(fsp, cv2.IMREAD_GRAYSCALE))
-            try:
-                flim = im[::-1, ::-1]
-                height, width = im.shape[:2]
-                datas.append({'id': idc, 'picpath': shortpath,
-                          'top_dct': gmpy2.digits(dct_hint(im[:width * __RAT__, :])),
-                          'bot_dct': gmpy2.digits(dct_hint(flim[:width * __RAT__, :]))})
-            except TypeError as e:
-                print("{} No picture was loaded for path: {}".format(e, fsp))
-    print("{} new pics dct'd".format(counter))
-    print("adding {} new lines of data to orient from {} card-paths".format(len(datas), len(cardpaths)))
-    if datas:
-        orient_db.add_data(datas, 'orient', 'id')
-        print("committed!")
-
-    q = orient_db.cur.execute("SELECT id FROM orient").fetchall()
-    print("there are now {} lines in orient".format(len(q)))
-    return datas
-
-
 def idname(id):
     r = peep.card_db.cur.execute("SELECT name, code, id from cards where id=?", (id,)).fetchone()
     return r['name'], r['code'], r['id']
@@ -172,7 +117,7 @@ def showpics(ids, wait=0):
         if r:
             if r['pic_path']:
                 cv2.imshow("{} {} {}".format(r['code'], r['name'], r['pic_path']),
-                           cv2.imread(os.path.join(peep.__mtgpics__, r['pic_path'])))
+                           packstore.imread(os.path.join(peep.__mtgpics__, r['pic_path'])))
             else:
                 print("no pic: {} {}".format(r['name'], r['code']))
         else:
@@ -215,33 +160,230 @@ def bring_up():
         cv2.destroyAllWindows()
 
 
+__popcount8__ = np.array([bin(i).count('1') for i in xrange(256)], dtype=np.uint8)   # set bits in each byte value
+
+
+def hamming(hashes, dct):
+    """
+    hamming distances from one 64-bit hash to every hash in a uint64 array, all in one go:
+    xor, then look up the set bits of each of the 8 bytes and add them up.
+    Returns: uint8 array, same length as 'hashes'
+    """
+    x = np.bitwise_xor(hashes, np.uint64(int(dct)))
+    return __popcount8__[x.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+__mih_parts__ = 4     # multi-index hashing: each 64-bit hash is looked up by its four 16-bit quarters
+__mih_reach__ = 3     # most bits flipped in a quarter when probing; wider searches just scan everything
+__pop16__ = __popcount8__[np.arange(1 << 16) & 0xFF] + __popcount8__[np.arange(1 << 16) >> 8]
+__flips__ = np.argsort(__pop16__, kind='mergesort').astype(np.uint16)  # 16-bit masks, fewest set bits first
+__flip_ends__ = np.cumsum(np.bincount(__pop16__, minlength=17))         # masks with <= s bits: __flips__[:ends[s]]
+
+
+class MultiIndex(object):
+    """
+    multi-index hashing over a uint64 array of hashes, for radius and k-nearest searches that don't look at every row.
+    Two hashes within r bits of each other must match to within r // 4 bits in at least one of their four quarters,
+    so each quarter gets a table of which rows hold which 16-bit value, and a query only has to look at the rows
+    filed under the values near its own quarters. Those candidates are then checked with hamming().
+    """
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.orders, self.starts = [], []
+        for t in xrange(__mih_parts__):
+            quarter = ((hashes >> np.uint64(16 * t)) & np.uint64(0xFFFF)).astype(np.uint16)
+            order = np.argsort(quarter, kind='mergesort')
+            self.orders.append(order)   # row numbers, by value of this quarter
+            self.starts.append(np.searchsorted(quarter[order], np.arange((1 << 16) + 1)))   # where each value begins
+
+    def quarters(self, dct):
+        dct = int(dct)
+        return [(dct >> (16 * t)) & 0xFFFF for t in xrange(__mih_parts__)]
+
+    def lookup(self, dct, flips):
+        """ sorted row numbers whose quarters match one of the query's quarters, xor one of 'flips' """
+        found = []
+        for t, quarter in enumerate(self.quarters(dct)):
+            probes = np.bitwise_xor(flips, np.uint16(quarter)).astype(np.intp)
+            lo, hi = self.starts[t][probes], self.starts[t][probes + 1]
+            sizes = hi - lo
+            offsets = np.repeat(lo - (np.cumsum(sizes) - sizes), sizes)
+            found.append(self.orders[t][offsets + np.arange(sizes.sum())])
+        return np.unique(np.concatenate(found))
+
+    def radius(self, dct, r):
+        """ sorted row numbers of the hashes within r bits of 'dct' """
+        if r < 0:
+            return np.empty(0, dtype=np.intp)
+        if r // __mih_parts__ > __mih_reach__:
+            return np.flatnonzero(hamming(self.hashes, dct) <= r)
+        rows = self.lookup(dct, __flips__[:__flip_ends__[r // __mih_parts__]])
+        return rows[hamming(self.hashes[rows], dct) <= r]
+
+    def nearest(self, dct, k):
+        """
+        the k hashes closest to 'dct' (fewer if there aren't k), widening the probes a bit at a time.
+        Returns: (row numbers, hamming distances), nearest first
+        """
+        k = min(k, len(self.hashes))
+        rows = np.empty(0, dtype=np.intp)
+        for s in xrange(__mih_reach__ + 1):
+            rows = np.union1d(rows, self.lookup(dct, __flips__[__flip_ends__[s - 1] if s else 0:__flip_ends__[s]]))
+            dists = hamming(self.hashes[rows], dct)
+            # every hash within (s + 1) * 4 - 1 bits has been found by now
+            if np.sum(dists < (s + 1) * __mih_parts__) >= k:
+                break
+        else:
+            rows = np.arange(len(self.hashes))
+            dists = hamming(self.hashes, dct)
+        best = np.argsort(dists, kind='mergesort')[:k]
+        return rows[best], dists[best]
+
+
+Survey = namedtuple('Survey', 'ids, dists, ups, downs')     # what Simile.survey() finds
+
+
+def closer(hist, dist):
+    """ how many hashes in a Survey histogram are less than 'dist' bits away """
+    return int(hist[:max(dist, 0)].sum())
+
+
+def first_with(hist, n):
+    """ the least distance that n of the hashes in a Survey histogram are closer than (65 if there aren't n) """
+    return int(min(np.searchsorted(np.cumsum(hist), n), 64)) + 1 if n > 0 else 0
+
+
+def read_hashes(db=orient_db):
+    """
+    the hashes and faces of every picture in 'orient' that has them all.
+    Returns: (uint64 array, shape (3, n): tops, bottoms and face counts; unicode array of the n card ids)
+    """
+    rows = db.cur.execute("""SELECT top_dct, bot_dct, face, id FROM orient
+                             WHERE top_dct IS NOT NULL AND bot_dct IS NOT NULL AND face IS NOT NULL""").fetchall()
+    hashes = np.array([(int(line['top_dct']), int(line['bot_dct']), line['face']) for line in rows],
+                      dtype=np.uint64).reshape(-1, 3).T.copy()
+    return hashes, np.array([line['id'] for line in rows], dtype=np.unicode_)  # fixed width, so it can be mapped too
+
+
+def generation(db=orient_db):
+    """ (times 'orient' has changed, the time the index files are good for); (0, -1) before the first index """
+    return db.cur.execute("SELECT generation, indexed FROM orient_generation").fetchone() or (0, -1)
+
+
+def write_index(db=orient_db, fn=__simfile__, idfn=__simids__):
+    """
+    compile the hashes into the index files Simile memory-maps, when the database has changed since last time.
+    The files are written aside then renamed, so readers never see half of one.
+    Returns: the database generation the files are good for
+    """
+    now, indexed = generation(db)
+    if now == indexed and os.path.isfile(fn) and os.path.isfile(idfn):
+        return now
+    hashes, ids = read_hashes(db)
+    for name, arr in [(fn, hashes), (idfn, ids)]:
+        with open(name + '.tmp', 'wb') as fob:
+            np.save(fob, arr)
+        if os.path.isfile(name) and 'nt' in os.name:
+            os.remove(name)
+        os.rename(name + '.tmp', name)
+    if not db.cur.execute("UPDATE orient_generation SET indexed=?", (now,)).rowcount:
+        db.cur.execute("INSERT INTO orient_generation (generation, indexed) VALUES (?, ?)", (now, now))
+    db.con.commit()
+    print("compiled {} hashes into {} (generation {})".format(len(ids), fn, now))
+    return now
+
+
+def load_index(db=orient_db, fn=__simfile__, idfn=__simids__):
+    """ (hashes, ids) like read_hashes(), memory-mapped from the index files; None if they're missing or stale """
+    now, indexed = generation(db)
+    if now != indexed:
+        return None
+    try:
+        return np.load(fn, mmap_mode='r'), np.load(idfn, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+
+
 class Simile(object):
-    def __init__(self, just_faces=False):
-        outgoing = np.vstack(((mpz(line['top_dct']), mpz(line['bot_dct']), line['face'], line['id']) for line in
-                              orient_db.cur.execute("SELECT top_dct, bot_dct, id, face FROM orient").fetchall()))
-        facemask = np.where(outgoing[:, 2] >= just_faces)
-        self.ups = outgoing[facemask, 0]
-        self.dwn = outgoing[facemask, 1]
-        self.ids = outgoing[facemask, 3]
+    def __init__(self, just_faces=False, compiled=True):
+        """
+        just_faces: only the pictures with a face in them
+        compiled: memory-map the index files from write_index() when they're up to date,
+        instead of reading every row of 'orient'. Processes that map them share the pages.
+        """
+        hashes, ids = (compiled and load_index()) or read_hashes()
+        if just_faces:
+            keep = np.flatnonzero(hashes[2] >= just_faces)
+            hashes, ids = hashes[:, keep], ids[keep]
+        # contiguous uint64s, 8 bytes a hash, rather than object arrays of mpz. Row numbers stand in for the ids.
+        self.ups, self.dwn, self.faces, self.ids = hashes[0], hashes[1], hashes[2], ids
+        self._up_index = self._dwn_index = None
         self.default_distance = 6
-        # vectorize lets gmpy2.hamdist get 'broadcast' over numpy arrays. speedily.
-        self.gmp_hamm = np.vectorize(gmpy2.hamdist)
+
+    @property
+    def up_index(self):
+        """ MultiIndex of the tops, built the first time it's wanted """
+        if self._up_index is None:
+            self._up_index = MultiIndex(self.ups)
+        return self._up_index
+
+    @property
+    def dwn_index(self):
+        if self._dwn_index is None:
+            self._dwn_index = MultiIndex(self.dwn)
+        return self._dwn_index
+
+    def memory(self, show=True):
+        """
+        bytes used by the arrays of hashes, next to what object arrays of mpz (the old way) would take.
+        Returns: {name: bytes, ...}
+        """
+        per_mpz = sys.getsizeof(mpz(2 ** 63 + 1)) + np.dtype(object).itemsize    # the object plus its pointer
+        used = {'ups': self.ups.nbytes, 'dwn': self.dwn.nbytes, 'faces': self.faces.nbytes, 'ids': self.ids.nbytes,
+                'as mpz objects': per_mpz * (len(self.ups) + len(self.dwn))}
+        if show:
+            print("Simile: {} hashes up & down in {:,} bytes ({:,} as mpz objects), ids {:,} bytes, faces {:,} bytes"
+                  .format(len(self.ups), used['ups'] + used['dwn'], used['as mpz objects'], used['ids'],
+                          used['faces']))
+        return used
 
     def hamm_ups(self, dct, cutval):
         """
-        dct: single mpz(uint64) to 'hamm' against all the other values
+        dct: single 64-bit hash (mpz, int or uint64) to 'hamm' against all the other values
         cutval: the hamming distance threshold with which to filter the array
 
         Returns
         -------
         array of ids from the big list that have hamming distance less than cutval from 'dct'
         """
-        return self.ids[np.where(self.gmp_hamm(self.ups,  dct) < cutval)]
+        return self.ids[self.up_index.radius(dct, cutval - 1)]
 
     def hamm_down(self, dct, cutval):
-        return self.ids[np.where(self.gmp_hamm(self.dwn,  dct) < cutval)]
+        return self.ids[self.dwn_index.radius(dct, cutval - 1)]
+
+    def nearest(self, dct, k=4, down=False):
+        """ (ids, hamming distances) of the k database pics whose top (or bottom, when 'down') is nearest 'dct' """
+        rows, dists = (self.dwn_index if down else self.up_index).nearest(dct, k)
+        return self.ids[rows], dists
+
+    def survey(self, dct, k=4, reach=20):
+        """
+        the distances from 'dct' to every top and every bottom in the database, each worked out just once.
+        k: the ids list holds at least the k nearest, however far away they are
+        reach: ...and every id whose top is less than 'reach' bits away
+
+        Returns
+        -------
+        Survey: ids (nearest first) and dists of those tops; ups and downs, histograms of how many tops and
+        bottoms are each number of bits away, eg. closer(survey.ups, 6) counts the tops less than 6 bits away
+        """
+        up_dists, down_dists = hamming(self.ups, dct), hamming(self.dwn, dct)
+        ups, downs = np.bincount(up_dists, minlength=65), np.bincount(down_dists, minlength=65)
+        rows = np.flatnonzero(up_dists < max(reach, first_with(ups, k)))
+        rows = rows[np.argsort(up_dists[rows], kind='mergesort')]
+        return Survey(self.ids[rows], up_dists[rows], ups, downs)
 
-    def handful(self, img, flipit=15, dist=None):
+    def handful(self, img, flipit=15):
         """
         img: full image probably lifted from a user input device
         flipit: the hamming distance where it may be wise to try an inverted version of img to get closer results
@@ -249,61 +391,44 @@ class Simile(object):
         Returns
         -------
         list1: a list of 4 or more ids-to-database-images with the closest hamming distance
-        to the top of the input img dct.
+        to the top of the input img dct, nearest first.
         """
-        if dist is None:
-            dist = self.default_distance
-        dct = dct_hint(cv2.equalizeHist(cv2.cvtColor(img[:img.shape[1] * __RAT__, :], cv2.COLOR_BGR2GRAY)))
-        SEARCH = True
-        while SEARCH:
-            list1 = self.hamm_ups(dct, dist)
-            if len(list1) < 4:
-                dist += 2
-                continue
-            if len(self.hamm_ups(dct, dist - 1)) > 3:
-                dist -= 1
-                continue
-            SEARCH = False
-        #print("results at distance: {} (flipit={})".format(self.default_distance, flipit))
+        found = self.survey(top_hints([img])[0], k=min(4, len(self.ids)))
+        # the least distance with 4 or more tops closer than it
+        dist = first_with(found.ups, min(4, len(self.ids)))
         if dist > flipit:
-            return self.handful(img[::-1, ::-1], flipit=flipit+1, dist=dist-5)
-        #print("".join(("{:3}: {}{}".format(n+1, idname(l)[:2], os.linesep) for n, l in enumerate(list1))))
-        return list1
+            return self.handful(img[::-1, ::-1], flipit=flipit+1)
+        return found.ids[:closer(found.ups, dist)]
 
     def updown(self, img, rng=(4, 18)):
         """ for testing different efficient ways of telling up from downc """
-        dct = dct_hint(cv2.equalizeHist(cv2.cvtColor(img[:img.shape[1] * __RAT__, :], cv2.COLOR_BGR2GRAY)))
-        dd = {}
-        for dist in xrange(rng[0], rng[1]):
-            dd[dist] = (len(self.hamm_ups(dct, dist)), len(self.hamm_down(dct, dist)))
-        return dd
+        found = self.survey(top_hints([img])[0], reach=0)
+        return {dist: (closer(found.ups, dist), closer(found.downs, dist)) for dist in xrange(rng[0], rng[1])}
 
     def fistfull(self, img, trips=0, grip=1):
         """ replaces handful with a rube-goldberg machine """
         if trips > 2:
-            # always gives at least one result but always uses the same quantity of costly operations
-            dcts = [dct_hint(cv2.equalizeHist(cv2.cvtColor(im[:int(im.shape[1] * __RAT__), :], cv2.COLOR_BGR2GRAY)))
-                    for im in [img, img[::-1, ::-1]]]
+            # always gives at least one result: surveys the image both ways up
             start, uplist = 5, {}
+            founds = [self.survey(dct, reach=20 + grip) for dct in top_hints([img, img[::-1, ::-1]])]
             # counting the zeroes determines the quality of each list (fewer=better) and
             # index of first result > 0 (plus starting value) is the min cut value for generating the list of ids
-            for tag, dct in enumerate(dcts):
-                uplist[tag] = [np.sum(self.gmp_hamm(self.ups, dct) < dist) for dist in xrange(start, 19)].count(0)
+            for tag, found in enumerate(founds):
+                uplist[tag] = [closer(found.ups, dist) for dist in xrange(start, 19)].count(0)
             best_idx, first_result = sorted([(k, v) for k, v in uplist.viewitems()], key=itemgetter(1))[0]
             print("*** used long way home ***")
-            return self.hamm_ups(dcts[best_idx], first_result + start + grip)  # success!
+            return founds[best_idx].ids[:closer(founds[best_idx].ups, first_result + start + grip)]  # success!
 
         # uses pre-calculated "downs" to avoid doing two dcts on sample, and can exit early very often
         # also tries to return more than 1 result in an effort to give the matcher some options
-        dct = dct_hint(cv2.equalizeHist(cv2.cvtColor(img[:int(img.shape[1] * __RAT__), :], cv2.COLOR_BGR2GRAY)))
+        found = self.survey(top_hints([img])[0])
         for dist in xrange(6, 20):
-            ups = np.sum(self.gmp_hamm(self.ups,  dct) < dist)
-            downs = np.sum(self.gmp_hamm(self.dwn,  dct) < dist)
+            ups, downs = closer(found.ups, dist), closer(found.downs, dist)
             # print("{:3}:  ups {},  downs {}".format(dist, ups, downs))
             if ups == downs:
                 continue
             if (ups > (3 - trips)) and (ups > (downs - trips)):
-                return self.hamm_ups(dct, dist)     # success!
+                return found.ids[:ups]     # success!
             if (downs > trips) and (downs > ups):
                 return self.fistfull(img[::-1, ::-1], trips=trips+1)     # recur a little bit
 
@@ -321,39 +446,6 @@ def mirror_cards():
     return 1
 
 
-def akazer(pics=None, akaze=None, columns='ak_points,ak_desc'):
-    """
-    Not just for AKAZE any more!
-
-    Parameters
-    ----------
-    pics = {id: local-path-to-pic, ...}
-    akaze = cv2.AKAZE_create() or cv2.ORB_create() or cv2.KAZE_create() etc..
-    columns = two comma separated column names for the new data
-    Returns
-    -------
-    list of image data formatted for entering into cards database
-    """
-    new_data = []
-    if pics is None:
-        pics = cards()
-    if akaze is None:
-        akaze = cv2.AKAZE_create()
-    c1, c2 = columns.split(',')
-    for kk, vv in pics.viewitems():
-        if vv:
-            im = cv2.imread(vv)
-        else:
-            im = None
-        if im is not None:
-            akps, adesc = akaze.detectAndCompute(im, None)
-            jk = [(a.pt, a.angle, a.class_id, a.octave, a.response, a.size) for a in akps]
-            new_data.append({'id': kk, c1: jk, c2: Binary(adesc.dumps())})
-        else:
-            print("for id: {}, akazer failed to find pic on path: {}".format(kk, vv))
-    return new_data
-
-
 def get_kpdesc(id, c1='ak_points', c2='ak_desc'):
     """
     retrieve and re-hydrate the key-point and descriptor data for a single card id
@@ -369,46 +461,84 @@ def get_kpdesc(id, c1='ak_points', c2='ak_desc'):
             for a in line[c1]], np.loads(str(line[c2]))
 
 
-def run_akazer(workchunk=100, db=orient_db, dbtable='orient', columns='ak_points,ak_desc', fs=peep.__mtgpics__):
+def process_pictures(cardmap, batch=150, akaze=None, columns='ak_points,ak_desc', scale=1.25, min_neighbor=4,
+                     db=orient_db, dbtable='orient'):
+    """
+    works out the dct hashes, the face count and the AKAZE keypoints of each picture in one pass: it's decoded
+    just once (in color only when it still needs keypoints) and that one image feeds the dct hashes, the face finder
+    and the feature detector, doing only what the database says is missing.
+    Results go in one transaction per 'batch' pictures.
+    cardmap: {database id: local/path/to/pic, ...}
+
+    Returns
+    -------
+    counter object showing the quantity of examined pics with a given number of faces detected.
+    """
     pntcol, desc_col = columns.split(',')
-    ADD_COLUMNS = False
-    current_columns = db.show_columns(dbtable)
-    if (pntcol not in current_columns) or (desc_col not in current_columns):
-        ADD_COLUMNS = True
-        needed = db.cur.execute("SELECT id, picpath FROM {} WHERE picpath IS NOT NULL"
-                                .format(dbtable)).fetchmany(size=workchunk)
-    else:
-        needed = db.cur.execute("SELECT id, picpath FROM {} WHERE picpath IS NOT NULL and {} IS NULL"
-                                .format(dbtable, pntcol)).fetchmany(size=workchunk)
-        # remove missing paths
-    cardstack = {}
-    for want in needed:
-        full_path = os.path.join(fs, want['picpath'])
-        if os.path.isfile(full_path):
-            cardstack[want['id']] = full_path
-    if not cardstack:
-        print("finished adding keypoint and descriptor data")
-        return 0
-    with Timer(msg="processing {} new items".format(len(cardstack))):
-        dataa = akazer(pics=cardstack, columns=columns)
-        if ADD_COLUMNS:
-            db.add_columns(dbtable, peep.column_type_parser(dataa))
-        db.add_data(dataa, dbtable, key_column='id')
-    return 1
+    present = db.show_columns(dbtable)
+    missing = "{} IS NULL".format(pntcol) if pntcol in present else "1"
+    todo = {}
+    for idc, no_dct, no_face, no_kp in db.cur.execute("SELECT id, top_dct IS NULL, face IS NULL, {} FROM {}"
+                                                      .format(missing, dbtable)):
+        if idc in cardmap and (no_dct or no_face or no_kp):
+            todo[idc] = (bool(no_dct), bool(no_face), bool(no_kp))
+    facecount = Counter()
+    if not todo:
+        print("All dct, face and keypoint data was done previously")
+        return facecount
+    print("processing {} pictures for dct, faces and keypoints".format(len(todo)))
+    face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+    if akaze is None:
+        akaze = cv2.AKAZE_create()
+    datas = []
+    for n, (idc, (need_dct, need_face, need_kp)) in enumerate(todo.viewitems(), 1):
+        fsp = cardmap[idc]
+        im = packstore.imread(fsp, cv2.IMREAD_COLOR if need_kp else cv2.IMREAD_GRAYSCALE)
+        if im is None:
+            print("No picture was loaded for id: {} path: {}".format(idc, fsp))
+            continue
+        eq = cv2.equalizeHist(cv2.cvtColor(im, cv2.COLOR_BGR2GRAY) if im.ndim == 3 else im)
+        line = {'id': idc, 'picpath': os.path.sep.join(fsp.split(os.path.sep)[-2:])}
+        if need_dct:
+            flim = eq[::-1, ::-1]
+            cut = int(eq.shape[1] * __RAT__)
+            line['top_dct'], line['bot_dct'] = map(str, dct_hints([eq[:cut, :], flim[:cut, :]]))
+        if need_face:
+            line['face'] = len(face_cascade.detectMultiScale(eq, scaleFactor=scale, minNeighbors=min_neighbor))
+            facecount[line['face']] += 1
+        if need_kp:
+            akps, adesc = akaze.detectAndCompute(im, None)
+            line[pntcol] = [(a.pt, a.angle, a.class_id, a.octave, a.response, a.size) for a in akps]
+            if adesc is not None:   # no keypoints, no descriptors
+                line[desc_col] = Binary(adesc.dumps())
+        datas.append(line)
+        if len(datas) >= batch:
+            db.tracker(dbtable).learn(datas)
+            db.add_data(datas, dbtable, key_column='id')
+            print("{} of {} pictures processed".format(n, len(todo)))
+            datas = []
+    if datas:
+        db.tracker(dbtable).learn(datas)
+        db.add_data(datas, dbtable, key_column='id')
+    return facecount
 
 
-def init_and_check():
+def init_and_check(changed_only=False):
     """
     call this along with populate.py and picfinder.py to fill up database when running on remote server
+    changed_only: only hash and face-check the new or changed cards from the latest populate run
     """
+    ids = None
+    if changed_only:
+        changes = peep.changed_cards()
+        if changes is not None:
+            ids = set(i for id_list in changes.viewvalues() for i in id_list)
     mirror_cards()
     #print("mirror done")
-    add_dct_data(cards())
-    #print("add dct done")
-    for nn, qq in find_faces(needed_faces(cards(), examine_zeros=False)).viewitems():
+    cardmap = {i: p for i, p in cards(ids=ids).viewitems() if manifest.present(p)}
+    for nn, qq in process_pictures(cardmap, batch=150, columns='ak_points,ak_desc').viewitems():
         print("with {} face(s) --> {}".format(nn, qq))
-    while run_akazer(workchunk=150, db=orient_db, dbtable='orient', columns='ak_points,ak_desc'):
-        continue
+    write_index()
 
 
 FLANN_INDEX_KDTREE = 1
@@ -427,6 +557,7 @@ def main():
     init_and_check()
     simulate = Simile(just_faces=False)
     smiles = Simile(just_faces=True)
+    simulate.memory()
     default_distance = 15
     cap = cv2.VideoCapture(0)
     face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
@@ -498,7 +629,7 @@ def main():
                             filtered_m = []
                     if filtered_m:
                         imp = orient_db.cur.execute("SELECT picpath FROM orient WHERE id=(?)", (l,)).fetchone()
-                        img2 = cv2.imread(os.path.join(peep.__mtgpics__, imp['picpath']))
+                        img2 = packstore.imread(os.path.join(peep.__mtgpics__, imp['picpath']))
                         img3 = cv2.drawMatchesKnn(img1, kp, img2, ckp, filtered_m,
                                                   outImg=np.zeros((600, 800), dtype=np.uint8), flags=2)
                         cv2.imshow("{}".format(num), img3)
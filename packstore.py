@@ -0,0 +1,137 @@
+#!/usr/bin/env python -S
+# -*- coding: utf-8 -*-
+"""
+a packed store of the card pictures: one big file of already-decoded, fixed-size BGR rasters
+and an index (in the cards database) of which slot holds which picture.
+
+The file is opened with mmap, so a packed picture comes back as a numpy view straight onto it,
+with no file to open and no jpeg to decode. The views are read-only: copy one before drawing on it.
+Pictures that aren't the standard size, or that changed since they were packed, are read from /pics/ as always.
+At 445x312 pixels that's about 400 kB a card, so 30,000 cards need 12 GB or so of disk.
+
+>> python packstore.py          packs the pictures that are new or changed since last time
+>> python packstore.py force    starts the pack file over
+"""
+import os
+import sys
+import sqlite3
+import cv2
+import numpy as np
+import populate as peep
+import manifest
+
+__packfile__ = os.getcwd() + os.sep + 'mtg_pics.pack'
+__shape__ = (445, 312, 3)   # rows, columns, channels of every packed raster (the usual size of a card scan)
+__batch__ = 500             # pictures packed between commits of the index
+
+pack_db = peep.DBMagic(DBfn=peep.__sqlcards__,
+                       DBcolumns={'pack': '''CREATE TABLE pack (path TEXT PRIMARY KEY, slot INTEGER, hash TEXT)'''},
+                       DB_DEBUG=True)
+
+
+class PackStore(object):
+    """
+    the pack file and its index. A picture gets a slot when it's first packed and keeps it;
+    a changed picture is written over its old slot. Slot NULL marks a picture that can't be packed.
+    """
+    def __init__(self, fn=__packfile__, shape=__shape__, db=pack_db, fs=peep.__mtgpics__):
+        self.fn = fn
+        self.shape = tuple(shape)
+        self.frame = int(np.prod(self.shape))
+        self.db = db
+        self.fs = fs
+        self.slots = None       # {manifest key: slot} of the packed pictures still matching the manifest
+        self.rasters = None     # np.memmap, shape (slots, rows, columns, channels)
+
+    def load(self):
+        """ (re)read the index and map the file. Returns: number of pictures available packed """
+        self.rasters, self.slots = None, {}
+        count = os.path.getsize(self.fn) // self.frame if os.path.isfile(self.fn) else 0
+        if not count:
+            return 0    # nothing packed: leave the database alone, every picture comes from /pics/
+        try:
+            slots = dict(self.db.cur.execute('''SELECT pack.path, pack.slot FROM pack JOIN manifest
+                                             ON manifest.path = pack.path AND manifest.hash = pack.hash
+                                             WHERE pack.slot < ?''', (count,)).fetchall())
+        except sqlite3.OperationalError as e:     # eg no manifest table yet in a database from before it
+            print("packed pictures unavailable, reading them from {}: {}".format(self.fs, e))
+            return 0
+        self.rasters = np.memmap(self.fn, dtype=np.uint8, mode='r', shape=(count,) + self.shape)
+        self.slots = slots
+        return len(self.slots)
+
+    def view(self, fn):
+        """ the packed raster of picture 'fn' (full or relative path), or None when it isn't packed """
+        if self.slots is None:
+            self.load()
+        slot = self.slots.get(manifest.key(fn, self.fs))
+        return None if slot is None else self.rasters[slot]
+
+    def imread(self, fn, flags=cv2.IMREAD_COLOR):
+        """ in place of cv2.imread(fn, flags), for pictures under /pics/ """
+        im = self.view(fn)
+        if im is None:
+            return cv2.imread(fn, flags)
+        if flags == cv2.IMREAD_GRAYSCALE:
+            return cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+        return im
+
+    def build(self, force=False):
+        """
+        decode and pack every picture in the manifest that is new or changed since it was packed.
+        force: throw out the pack file and index and start again
+        Returns: number of pictures packed
+        """
+        manifest.refresh(self.fs)
+        self.slots = self.rasters = None
+        if force:
+            self.db.cur.execute("DELETE FROM pack")
+            self.db.con.commit()
+            if os.path.isfile(self.fn):
+                os.remove(self.fn)
+        front = manifest.root(self.fs)
+        packed = {r[0]: (r[1], r[2]) for r in self.db.cur.execute("SELECT path, slot, hash FROM pack")
+                  if manifest.mine(r[0], self.fs)}
+        wanted = sorted(r for r in self.db.cur.execute("SELECT path, hash FROM manifest").fetchall()
+                        if manifest.mine(r[0], self.fs))
+        gone = [(p,) for p in set(packed) - set(w[0] for w in wanted)]
+        todo = [(p, h) for p, h in wanted if packed.get(p, (None, None))[1] != h]
+        count, done, rows = (os.path.getsize(self.fn) // self.frame if os.path.isfile(self.fn) else 0), 0, []
+        with open(self.fn, 'r+b' if os.path.isfile(self.fn) else 'w+b') as fob:
+            for n, (path, h) in enumerate(todo, 1):
+                slot = packed.get(path, (None, None))[0]
+                im = cv2.imread(os.path.join(self.fs, manifest.relative(path, front)), cv2.IMREAD_COLOR)
+                if im is None or im.shape != self.shape:
+                    rows.append((path, None, h))    # its old slot, if it had one, goes unused
+                else:
+                    if slot is None:
+                        slot, count = count, count + 1
+                    fob.seek(slot * self.frame)
+                    fob.write(np.ascontiguousarray(im).tobytes())
+                    rows.append((path, slot, h))
+                    done += 1
+                if len(rows) >= __batch__ or n == len(todo):
+                    fob.flush()
+                    with self.db.transaction() as cur:
+                        cur.executemany("INSERT OR REPLACE INTO pack (path, slot, hash) VALUES (?, ?, ?)", rows)
+                    rows = []
+                    if self.db.DB_DEBUG:
+                        print("{} of {} pictures checked for packing".format(n, len(todo)))
+        with self.db.transaction() as cur:
+            cur.executemany("DELETE FROM pack WHERE path=?", gone)
+        if self.db.DB_DEBUG:
+            print("packed {} pictures into {} ({} slots)".format(done, self.fn, count))
+        return done
+
+
+pictures = PackStore()
+
+
+def imread(fn, flags=cv2.IMREAD_COLOR):
+    """ cv2.imread(fn, flags), served from the pack file when the picture is packed there """
+    return pictures.imread(fn, flags)
+
+
+if __name__ == "__main__":
+    pictures.build(force='force' in sys.argv[1:])
+    print("{} pictures available packed".format(pictures.load()))
@@ -16,13 +16,18 @@ record the paths in the database.
 """
 
 import populate as peep
-import requests, grequests
-from collections import deque, defaultdict, Counter
+import webcache
+import manifest
+import requests
+from collections import defaultdict, Counter
 import Levenshtein as leven
-from operator import itemgetter
-from itertools import izip
 import os
+import re
 import json
+import shutil
+import unicodedata
+import numpy as np
+import cv2
 import sys
 reload(sys).setdefaultencoding("utf8")
 
@@ -34,6 +39,20 @@ __mci_jpg__ = __mci_front__ + '{}/{}.jpg'
 __mci_set_stub__ = "http://magiccards.info/{}/en.html"
 __mci_parser__ = '<td><a href="/{}/en/'
 __mci_sitemap__ = 'http://magiccards.info/sitemap.html'
+__mci_host_limit__ = 4  # most set pages requested from magiccards.info at once
+__leven_limit__ = 5     # names closer than this Levenshtein distance match, when nothing matches exactly
+__dl_limit__ = 7        # pictures downloading at once
+__dl_attempts__ = 3     # runs in which a picture download may fail before it's given up on
+__dl_states__ = ['pending', 'in-flight', 'done', 'failed']
+__part__ = '.part'      # downloads are written aside to a file with this ending, checked, then renamed into place
+__dl_ok__ = (200, 206, 404)     # answers to a picture request that aren't worth retrying in the same run
+
+# the persistent picture download queue, worked through by download_queue()
+dl_db = peep.DBMagic(DBfn=peep.__sqlcards__,
+                     DBcolumns={'downloads': '''CREATE TABLE downloads (id TEXT PRIMARY KEY, pic_link TEXT,
+                                pic_path TEXT, state TEXT, attempts INTEGER, last_error TEXT)'''},
+                     DBindexes={'downloads': ['state']},
+                     DB_DEBUG=True)
 
 # json data has some strangeness in it:
 # oddities will need to be matched to pics on different pages than 'normal' cards
@@ -62,20 +81,24 @@ def linkup(line):
     return __mci_jpg__.format(ms, num), name
 
 
+def parse_setlist(mci_setcode, lines):
+    """ the picture links found in the lines of a magiccards.info set page """
+    return dict([linkup(i) for i in lines if __mci_parser__.format(mci_setcode) in i])
+
+
 def setlist_links(mci_setcode):
     """
     mci_setcode: string from database ie 'isd'
-    return: links for all images in set {'Name of Card': 'http://address-to-image.jpg', ...}
+    return: links for all images in set {'http://address-to-image.jpg': 'Name of Card', ...}
     """
-    ri = requests.get(__mci_set_stub__.format(mci_setcode)).iter_lines()
-    return dict([linkup(i) for i in ri if __mci_parser__.format(mci_setcode) in i])
+    return parse_setlist(mci_setcode, webcache.get(__mci_set_stub__.format(mci_setcode)).iter_lines())
 
 
 def mci_sitemap_parser(sm=__mci_sitemap__, ):
     # mci set-codes are different than standard 3-all-caps, but often similar.
     # the json data for a newly released set often doesn't include the mci-set-code
     # this gets a list of all the possible mci codes.
-    r = requests.get(sm)
+    r = webcache.get(sm)
     MAIN_LINE = False
     mci_codes = list()
     if r.status_code != 200:
@@ -92,14 +115,17 @@ def mci_sitemap_parser(sm=__mci_sitemap__, ):
     return []
 
 
-def card_counts(counter_col):
+def card_counts(counter_col, codes=None):
     """
     return {set-code: mci-code, ...} for sets containing any cards missing a valid local image path
+    codes: only look at these set-codes (eg the ones populate.changed_cards() reports), or None for all
     """
-    # add some straggler mci codes if possible
-    mci_codes_from_sitemap = mci_sitemap_parser()
+    # add some straggler mci codes if possible. The sitemap is only fetched when some set lacks a code
+    mci_codes_from_sitemap = None
     for code, mci in setcodeinfo().viewitems():
-        if mci is None:
+        if mci is None and (codes is None or code in codes):
+            if mci_codes_from_sitemap is None:
+                mci_codes_from_sitemap = mci_sitemap_parser()
             if code.lower() in mci_codes_from_sitemap:
                 print("Using magiccards.info sitemap to add '{}' to setcodes".format(code.lower()))
                 peep.set_db.cur.execute("UPDATE {} SET magicCardsInfoCode=(?) WHERE code=(?)"
@@ -107,9 +133,10 @@ def card_counts(counter_col):
     peep.set_db.con.commit()
 
     # just check them all (in a set) if any are missing? seems ok
+    manifest.refresh()
     needs_links = {}
     for kkk, mci in setcodeinfo().viewitems():
-        if mci:
+        if mci and (codes is None or kkk in codes):
             allhits = peep.card_db.cur.execute("select code, pic_path from {} WHERE code=?"
                                                .format(peep.__cards_t__), (kkk,)).fetchall()
             for a in allhits:
@@ -117,146 +144,249 @@ def card_counts(counter_col):
                     needs_links.update({kkk: mci})
                     break
                 else:
-                    if not os.path.isfile(a['pic_path']):
+                    if not manifest.present(a['pic_path']):
                         needs_links.update({kkk: mci})
                         break
     return needs_links
 
 
-def num_from_urls(urls, num, layout):
-    # num is actually text
-    # must split it out to avoid finding '1' in '100'
-    for u in urls:
-        #print "urls u:", u
-        if num == u.split('/')[-1].split('.jpg')[0].strip():
-            return u
-    return False
+def url_number(url):
+    # 'http://magiccards.info/scans/en/isd/2.jpg' -> '2'
+    # the whole number is split out, to avoid finding '1' in '100'
+    return url.split('/')[-1].split('.jpg')[0].strip()
 
 
-def populate_links(setcodes):
+def normal_name(name):
+    """ card names as matching keys: unicode, in one normal form, without case or stray spaces """
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+    return unicodedata.normalize('NFKC', name).strip().lower()
+
+
+def link_indexes(links):
     """
-    setcodes = {three-character-all-caps-json-given-set-code: magiccards.info set-code, ...}
+    links = {'http://address-to-image.jpg': 'Name of Card', ...} as from setlist_links(), parsed just once
+    returns ({card number: [urls, ...]}, {normal_name(card name): [urls, ...]})
+    """
+    by_number, by_name = defaultdict(list), defaultdict(list)
+    for url, name in links.viewitems():
+        by_number[url_number(url)].append(url)
+        by_name[normal_name(name)].append(url)
+    return by_number, by_name
+
+
+def min_cost_assignment(cost):
+    """
+    the Hungarian method: picks one column for each row of the square 'cost' matrix (list of lists),
+    no column used twice, so that the total cost is as low as possible. O(n**3)
+    returns: [column for row 0, column for row 1, ...]
+    """
+    n, inf = len(cost), float('inf')
+    u, v, p, way = [0] * (n + 1), [0] * (n + 1), [0] * (n + 1), [0] * (n + 1)
+    for i in xrange(1, n + 1):
+        p[0], j0 = i, 0
+        minv, used = [inf] * (n + 1), [False] * (n + 1)
+        while p[j0]:
+            used[j0] = True
+            i0, delta, j1 = p[j0], inf, 0
+            row = cost[i0 - 1]
+            for j in xrange(1, n + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in xrange(n + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    picks = [0] * n
+    for j in xrange(1, n + 1):
+        picks[p[j] - 1] = j - 1
+    return picks
+
+
+def leven_matches(names, revlinks, limit=__leven_limit__):
+    """
+    names: the card names that are still unmatched
+    revlinks: {normal_name(link name): [urls still available], ...}
+    Distances are only worked out for pairs whose lengths differ by less than 'limit' (they can't be any closer
+    than that), and the pairs closer than 'limit' are then assigned all together, for the lowest total distance.
+    A card can't grab a link that another card matches better just by being looked at first.
+    returns: [(index into names, url, link name, distance), ...]
+    """
+    slots = [(other, url) for other, urls in revlinks.viewitems() for url in urls]
+    close = {}      # {(name index, link name): distance}
+    for n, name in enumerate(normal_name(a) for a in names):
+        for other in revlinks:
+            if abs(len(name) - len(other)) < limit:
+                d = leven.distance(name, other)
+                if d < limit:
+                    close[(n, other)] = d
+    # only the cards and link slots with at least one close partner go in the cost matrix
+    rows = sorted(set(n for n, _ in close))
+    wanted = set(other for _, other in close)
+    cols = [(other, url) for other, url in slots if other in wanted]
+    if not rows:
+        return []
+    size = max(len(rows), len(cols))
+    cost = [[limit] * size for _ in xrange(size)]       # 'limit' means unmatched
+    for r, n in enumerate(rows):
+        for c, (other, _) in enumerate(cols):
+            cost[r][c] = close.get((n, other), limit)
+    matches = []
+    for r, c in enumerate(min_cost_assignment(cost)):
+        if r < len(rows) and c < len(cols) and cost[r][c] < limit:
+            matches.append((rows[r], cols[c][1], cols[c][0], cost[r][c]))
+    return matches
+
+
+def link_set(s, mci, links, oddballs):
+    """
+    match one set's cards to its picture links, in one pass by number, then one pass by name, using
+    link_indexes(), before falling back on Levenshtein distance for whatever is left
+    s: json-given set code, mci: its magiccards.info code
+    links: {'http://address-to-image.jpg': 'Name of Card', ...} from all of the set's pages
+    oddballs: {layout: [unwanted items]} gets added to
     """
     sql = '''SELECT id, name, imageName, number, layout, code from {} where code=?'''.format(peep.__cards_t__)
     usql = '''UPDATE {} SET pic_link=? WHERE id=?'''.format(peep.__cards_t__)
+    # each chunk of work is determined by the official setcode, but won't go without mci codes
+    # remove the items with unwanted formats, like the huge cards etc.
+    work = []
+    for w in peep.card_db.cur.execute(sql, (s,)).fetchall():
+        if w['layout'] in oddities:
+            oddballs[w['layout']].append({k: w[k] for k in w.keys()})
+        else:
+            work.append(w)
+
+    starting_work = len(work)
+    # links are from web, work is from local
+    if len(links) != starting_work:
+        msg = u"{} aka {}: has {} web-based, but {} local items\n".format(s, mci, len(links), starting_work)
+        with open("local_mias", 'a+') as fob:
+            fob.write(msg)
+    by_number, by_name = link_indexes(links)
+    linked = set()
+
+    # try to match by card number in url, and local, .json-given 'number'
+    if s not in numberskip:
+        unmatched = []
+        for w in work:
+            urls = by_number.get(w['number'].strip()) if w['number'] else None
+            if urls:
+                result = urls.pop()
+                peep.card_db.cur.execute(usql, (result, w['id']))
+                linked.add(result)
+            else:
+                unmatched.append(w)
+        work = unmatched
+
+    #print(u"numbermatching: of {} db entries, {} remain{} for set='{}' aka http://magiccards.info/{}/en.html"
+    #     .format(starting_work, len(work), u's' if len(work) == 1 else u'', s, mci))
+
+    intermediate_work = len(work)
+
+    # try matching to href links by exact card-names in database
+    revlinks = {}
+    for name, urls in by_name.viewitems():
+        urls = [u for u in urls if u not in linked]
+        if urls:
+            revlinks[name] = urls
+    unmatched = []
+    for x, w in enumerate(work):      # used to match against 'imageName' as well. might go back to that.
+        name = normal_name(w['name'])
+        if revlinks.get(name):
+            peep.card_db.cur.execute(usql, (revlinks[name].pop(), w['id']))
+            continue
+        if name in revlinks:
+            print(u"set {} has no remaining exact match for: '{}'".format(s, w['name']))
+            # remove the key since it has no links remaining
+            revlinks.pop(name)
+        else:
+            print(u"{}: {} has No Key-name for: '{}'".format(x, s, w['name']))
+        unmatched.append(w)
+    work = unmatched
+
+    msg = u"started: {}   by numbers down to: {}   by exact names: {}  " \
+          u"for set='{}' aka http://magiccards.info/{}/en.html \n"\
+        .format(starting_work, intermediate_work, len(work), s, mci)
+    with open("local_mias", 'a+') as fob:
+        fob.write(msg)
+
+    # clear out empty entries
+    for k, l in revlinks.items():
+        if not l:
+            revlinks.pop(k)
+
+    # what remains of work doesn't match anything exactly.
+    # now use Levenshtein distance against names, pairing them all up at once for the lowest total distance.
+    matched = set()
+    for n, winning_link, winner, points in leven_matches([w['name'] for w in work], revlinks):
+        w = work[n]
+        matched.add(n)
+        revlinks[winner].remove(winning_link)
+        print(u"{}  - close enough match: (mtginfo)'{}'  ==  '{}'(local) SCORE: {}"
+              .format(winning_link, winner, w['name'], points))
+        peep.card_db.cur.execute(usql, (winning_link, w['id']))
+    work = [left for i, left in enumerate(work) if i not in matched]
+
+    # looks like the end of the line. Record remaining work.
+    if work:
+        msg = u"for set: {} aka {}, after all efforts, {} of {} items remain:"\
+               .format(s, mci, len(work), starting_work)
+        print(msg)
+        with open("local_mias", 'a+') as fob:
+            fob.write(msg + u"\n")
+    for n, w in enumerate(work):
+        msg = u"{}: {} | {} | {} | {}".format(n+1, s, w['name'], w['number'], w['id'])
+        print(msg)
+        with open("local_mias", 'a+') as fob:
+            fob.write(msg + u"\n")
+
+
+def populate_links(setcodes):
+    """
+    setcodes = {three-character-all-caps-json-given-set-code: magiccards.info set-code, ...}
+    every set page (and extrastuff page) is requested at once, a few at a time per host, and each set is
+    matched up by link_set() as soon as its pages are in, with all of its links written in one transaction
+    """
     oddballs = defaultdict(list)
     with open("local_mias", 'wb') as fob:
         fob.write("list of unmatched local database items:\n")
 
+    pages, waiting, gathered, failed = defaultdict(list), Counter(), defaultdict(dict), set()
     for s, mci in setcodes.viewitems():
         if mci is None:
             print("ATTENTION: {} has no magiccards.info code, and will get no pics from there!".format(s))
             continue
+        for code in [mci] + ([extrastuff[s]] if s in extrastuff else []):
+            pages[__mci_set_stub__.format(code)].append((s, code))
+            waiting[s] += 1
 
-        # each chunk of work is determined by the official setcode, but won't go without mci codes
-        work = deque(peep.card_db.cur.execute(sql, (s,)).fetchall())
-
-        # remove the items with unwanted formats, like the huge cards etc.
-        for x in xrange(len(work)):
-            w = work.pop()
-            if w['layout'] in oddities:
-                oddballs[w['layout']].append({k: w[k] for k in w.keys()})
-            else:
-                work.appendleft(w)
-
-        starting_work = len(work)
-        links = setlist_links(mci)
-        if s in extrastuff.keys():
-            links.update(setlist_links(extrastuff[s]))
-        # links are from web, work is from local
-        if len(links) != starting_work:
-            msg = u"{} aka {}: has {} web-based, but {} local items\n".format(s, mci, len(links), starting_work)
-            with open("local_mias", 'a+') as fob:
-                fob.write(msg)
-
-        # try to match by card number in url, and local, .json-given 'number'
-        for x in xrange(len(work)):
-            w = work.pop()
-            if w['code'] in numberskip:
-                work.appendleft(w)
+    for url, rsp in peep.window_getter(pages.keys(), per_host=__mci_host_limit__):
+        for s, code in pages[url]:
+            if s in failed:
                 continue
-            num, result = w['number'], False
-            if num:
-                result = num_from_urls(links.keys(), num.strip(), w['layout'])
-            if result:
-                peep.card_db.cur.execute(usql, (result, w['id']))
-                links.pop(result)
-            else:
-                work.appendleft(w)
-
-        #print(u"numbermatching: of {} db entries, {} remain{} for set='{}' aka http://magiccards.info/{}/en.html"
-        #     .format(starting_work, len(work), u's' if len(work) == 1 else u'', s, mci))
-
-        intermediate_work = len(work)
-
-        # try matching to href links by exact card-names in database
-        revlinks = defaultdict(list)
-        for k, v in links.viewitems():
-            revlinks[v.encode('utf-8')].append(k)
-        for name_col in ['name']:       # used to match against 'imageName' as well. might go back to that.
-            for x in xrange(len(work)):
-                w = work.pop()
-                try:
-                    peep.card_db.cur.execute(usql, (revlinks[w[name_col].encode('utf-8')].pop(), w['id']))
-                    continue
-                except IndexError:
-                    print(u"set {} has no remaining exact match for: '{}'".format(s, w[name_col].encode('utf-8')))
-                    # remove the key since it has no links remaining
-                    revlinks.pop(w[name_col].encode('utf-8'))
-                except KeyError:
-                    print(u"{}: {} has No Key-name for: '{}'".format(x, s, w[name_col].encode('utf-8')))
-                work.appendleft(w)
-
-        msg = u"started: {}   by numbers down to: {}   by exact names: {}  " \
-              u"for set='{}' aka http://magiccards.info/{}/en.html \n"\
-            .format(starting_work, intermediate_work, len(work), s, mci)
-        with open("local_mias", 'a+') as fob:
-            fob.write(msg)
-
-        # clear out empty entries
-        for k, l in revlinks.items():
-            if not l:
-                revlinks.pop(k)
-
-        # what remains of work doesn't match anything exactly.
-        # now use Levenshtein distance against names.
-        leven_msgs = []
-        for x in xrange(len(work)):
-            w = work.pop()
-            scored = []
-            msg = ""
-            for name in revlinks.viewkeys():
-                try:
-                    scored.append((name, leven.distance(w['name'].encode('utf-8'), name)))
-                except UnicodeDecodeError as e:
-                    print(u"{} :  -{}-  vs -{}-".format(e, w['name'].encode('utf-8', errors='replace'), name))
-                    scored.append((name, leven.distance(w['name'].encode('utf-8', errors='replace'), name)))
-            if not scored:
-                work.appendleft(w)
+            if rsp is None or rsp.status_code != 200:
+                # the set can't be matched without all of its pages
+                print("no set page for {} from: {}".format(s, url))
+                failed.add(s)
+                gathered.pop(s, None)
                 continue
-            winner, points = sorted(scored, key=itemgetter(1))[0]
-            if (points < 5) and revlinks[winner]:
-                winning_link = revlinks[winner].pop()
-                msg = u"{}  - close enough match: (mtginfo)'{}'  ==  '{}'(local) SCORE: {}"\
-                    .format(winning_link, winner, w['name'], points)
-                peep.card_db.cur.execute(usql, (winning_link, w['id']))
-            else:
-                work.appendleft(w)
-            if msg:
-                print(msg)
-
-        # looks like the end of the line. Record remaining work.
-        if work:
-            msg = u"for set: {} aka {}, after all efforts, {} of {} items remain:"\
-                   .format(s, mci, len(work), starting_work)
-            print(msg)
-            with open("local_mias", 'a+') as fob:
-                fob.write(msg + u"\n")
-        for n, w in enumerate(work):
-            msg = u"{}: {} | {} | {} | {}".format(n+1, s, w['name'], w['number'], w['id'])
-            print(msg)
-            with open("local_mias", 'a+') as fob:
-                fob.write(msg + u"\n")
+            gathered[s].update(parse_setlist(code, rsp.iter_lines()))
+            waiting[s] -= 1
+            if not waiting[s]:
+                with peep.card_db.transaction():
+                    link_set(s, setcodes[s], gathered.pop(s), oddballs)
 
     with open("oddballs.json", 'wb') as odd:
         json.dump(oddballs, odd)
@@ -267,130 +397,195 @@ def populate_links(setcodes):
     peep.card_db.con.commit()
 
 
-def download_pics(db=peep.card_db, fs_stub=peep.__mtgpics__, attempt=100, skip=None, remaining=0):
+def local_pic_path(fs_stub, code, pic_link):
+    """ where a card's picture lives: preserving unique web origination information and local setcode """
+    # windows compatibility hack (win OS hates the string 'CON'):
+    tag = 'win' if (code == 'CON') and ('nt' in os.name) else ''
+    return os.path.join(fs_stub, code + tag, "".join(pic_link.split("/")[-2:]))
+
+
+def queue_downloads(db=dl_db, fs_stub=peep.__mtgpics__):
     """
-    to avoid blasting the web-server with grequests, check for valid local pictures a few at a time.
-    Get the missing pics using the pic_link.  Also validate the db has links to pics already in the local
-    file-system without re-downloading them. Update the database.
+    one pass over the cards table: every card with a pic_link but no good local picture gets a 'pending'
+    row in the download queue (unless it's already queued for that same link). Pictures already on disk
+    just get their path recorded.
+    Returns: number of downloads pending
     """
-    if skip is None:
-        skip = []
-    sql = '''SELECT id, name, pic_path, pic_link, code from {}'''.format(peep.__cards_t__)
     usql = '''UPDATE {} SET pic_path=? WHERE id=?'''.format(peep.__cards_t__)
-    work = db.cur.execute(sql).fetchall()
-    real_work = []
-    needed_ids, needed_local_paths, needed_links = [], [], []
-    new_dirs = Counter()
-
-    # first filter out some causes of errors
-    for w in work:
-        # are we supposed to skip it (bad link already tried, etc)?
-        if w['id'] in skip:
-            continue
-        # is there a web-link to a picture?
-        if not w['pic_link']:
-            # print ("NO PIC LINK: {} of {}".format(w['name'], w['code']))
-            skip.append(w['id'])
-            continue
+    manifest.refresh(fs_stub)
+    queued = {r['id']: r for r in db.cur.execute("SELECT id, pic_link, state FROM downloads").fetchall()}
+    found, pending, paths = [], [], set()
+    for w in db.cur.execute("SELECT id, pic_path, pic_link, code FROM {} WHERE pic_link IS NOT NULL"
+                            .format(peep.__cards_t__)).fetchall():
         # is the pic_path already pointing to a file that is present and not empty?
-        if w['pic_path']:
-            prospect = os.path.join(fs_stub, w['pic_path'])
-            if os.path.isfile(prospect) and os.stat(prospect).st_size > 10:
-                continue
-        # if none of above, add to real_work
-        real_work.append(w)
-
-    work_pool = len(real_work)
-    successes = 0
-    # go to work on (some portion of) real work
-    for w in real_work[:min(attempt, work_pool)]:
-        # windows compatibility hack (win OS hates the string 'CON'):
-        tag = ''
-        if (w['code'] == 'CON') and ('nt' in os.name):
-            tag = 'win'
-        # preserve unique web origination information and local setcode in the filename:
-        q = os.path.join(fs_stub, w['code'] + tag, "".join(w['pic_link'].split("/")[-2:]))
-        if not (os.path.isfile(q) and os.stat(q).st_size > 10):
-            needed_local_paths.append(q)
-            needed_ids.append(w['id'])
-            needed_links.append(w['pic_link'])
-            new_dirs[os.path.join(fs_stub, w['code'] + tag)] += 1
-        else:
+        if w['pic_path'] and manifest.present(w['pic_path'], fs=fs_stub):
+            continue
+        q = local_pic_path(fs_stub, w['code'], w['pic_link'])
+        if manifest.present(q, fs=fs_stub):
             # the database held path was deleted, but there is a valid local pic file
-            # enter into db the local path info where it has apparently gone missing
-            successes += 1
-            db.cur.execute(usql, (os.path.join(q.split(os.path.sep)[-2:]), w['id']))
-
-    # check that all file-names are unique
+            found.append((os.path.join(*q.split(os.path.sep)[-2:]), w['id']))
+            continue
+        if q in paths:
+            print("  BAD:   picture path {} assigned to multiple ids, skipping {}".format(q, w['id']))
+            continue
+        paths.add(q)
+        old = queued.get(w['id'])
+        if old is None or old['pic_link'] != w['pic_link'] or old['state'] == __dl_states__[2]:
+            pending.append((w['id'], w['pic_link'], q))
+    with db.transaction() as cur:
+        cur.executemany(usql, found)
+        cur.executemany("DELETE FROM downloads WHERE id=?", ((i,) for i, _, _ in pending))
+        cur.executemany("INSERT INTO downloads (id, pic_link, pic_path, state, attempts) VALUES (?, ?, ?, ?, 0)",
+                        ((i, l, p, __dl_states__[0]) for i, l, p in pending))
+    return db.cur.execute("SELECT count(*) FROM downloads WHERE state=?", (__dl_states__[0],)).fetchone()[0]
+
+
+def fetch_pic(url, part, session):
+    """
+    streams a picture into the file 'part'. If some of it is already there (from a dropped connection)
+    only the rest is asked for, with an HTTP Range request.
+    Returns: the response, with .expected set to the size the whole file should be (None if the server won't say)
+    """
+    have = os.path.getsize(part) if os.path.isfile(part) else 0
+    headers = {'Accept-Encoding': 'identity'}
+    if have:
+        headers['Range'] = 'bytes={}-'.format(have)
+    rsp = session.get(webcache.stand_in(url), headers=headers, stream=True)
+    rsp.expected = None
+    if rsp.status_code == 416:      # the partial file is no good for resuming; the next try starts over
+        os.remove(part)
+    if rsp.status_code not in (200, 206):
+        return rsp
+    total = rsp.headers.get('Content-Length')
+    if rsp.status_code == 206:
+        resumed = re.match(r'bytes (\d+)-\d+/(\d+|\*)', rsp.headers.get('Content-Range', ''))
+        if resumed is None or int(resumed.group(1)) != have:
+            os.remove(part)
+            raise requests.RequestException("{} answered with the wrong range: {}"
+                                            .format(url, rsp.headers.get('Content-Range')))
+        total = resumed.group(2)
     try:
-        assert(len(set(needed_local_paths)) == len(needed_local_paths))
-    except AssertionError:
-        # show duplicate paths, ie one picture path assigned to multiple ids
-        for p, l, i in zip(needed_local_paths, needed_links, needed_ids):
-            idxs = [i for i, s in enumerate(needed_local_paths) if p == s]
-            if len(idxs) > 1:
-                print("  BAD:   picture paths assigned to multiple ids     *********")
-                for x in idxs:
-                    print needed_local_paths[x], " ", needed_links[x], " ", needed_ids[x]
-        exit(1)
-
-    # make new directories
-    for dir in new_dirs.keys():
-        if not os.path.isdir(dir):
-            os.makedirs(dir)
-
-    # prepare & send work to grequests
-    reqs = (grequests.get(u) for u in needed_links)
-
-    # take responses and turn into binary image files, record success in database by recording fs path
-    for lp, dbid, rsp in izip(needed_local_paths, needed_ids, grequests.map(reqs)):
-        if rsp.status_code == 200:
+        if not os.path.isdir(os.path.dirname(part)):
+            os.makedirs(os.path.dirname(part))
+        with open(part, 'ab' if rsp.status_code == 206 else 'wb') as fob:
+            for chunk in rsp.iter_content(1 << 16):
+                fob.write(chunk)
+    except (IOError, OSError) as e:
+        raise requests.RequestException("couldn't save {}: {}".format(part, e))
+    rsp.expected = int(total) if total and total.isdigit() else None
+    return rsp
+
+
+def verify_pic(fn, expected=None):
+    """
+    check a downloaded picture before it's put in place: the right size, and it decodes.
+    Returns: None if it's good, otherwise what's wrong with it
+    """
+    size = os.path.getsize(fn)
+    if expected is not None and size != expected:
+        return "{} bytes of {}".format(size, expected)
+    if size <= manifest.__min_size__:
+        return "only {} bytes".format(size)
+    data = np.fromfile(fn, dtype=np.uint8)
+    if fn.lower().endswith(('.jpg', '.jpeg', '.jpg' + __part__)) and '\xff\xd9' not in data[-64:].tostring():
+        return "jpeg is cut short"
+    if cv2.imdecode(data, cv2.IMREAD_UNCHANGED) is None:
+        return "won't decode"
+    return None
+
+
+def download_queue(db=dl_db, in_flight=__dl_limit__, max_attempts=__dl_attempts__, commit_every=50):
+    """
+    works through the pending downloads with a sliding window of 'in_flight' requests. Each picture is
+    streamed to a '.part' file, checked by verify_pic(), then renamed into place, so a half-written or broken
+    picture never shows up under its real name. A partial file is resumed where it stopped. Progress is committed
+    every 'commit_every' pictures; an interrupted run is picked up again where it left off (anything left
+    'in-flight' is simply pending again).
+    Returns: (pictures saved, downloads failed for good)
+    """
+    pending, in_flight_state, done, failed = __dl_states__
+    if webcache.__offline__:
+        # pictures aren't kept in the web cache (/pics/ is their cache), so they just wait for a run with a network
+        print("offline: {} pictures left waiting to download".format(
+            db.cur.execute("SELECT count(*) FROM downloads WHERE state=?", (pending,)).fetchone()[0]))
+        return 0, 0
+    usql = '''UPDATE {} SET pic_path=? WHERE id=?'''.format(peep.__cards_t__)
+    qsql = '''UPDATE downloads SET state=?, attempts=attempts + 1, last_error=? WHERE id=?'''
+    db.cur.execute("UPDATE downloads SET state=? WHERE state=?", (pending, in_flight_state))
+    db.con.commit()
+    work = defaultdict(list)    # {link: [queued rows]}, since cards can share a picture link
+    for r in db.cur.execute("SELECT id, pic_link, pic_path, attempts FROM downloads WHERE state=?", (pending,)):
+        work[r['pic_link']].append(r)
+    print("{} pictures to download".format(len(work)))
+
+    def starting(links):
+        for link in links:
+            db.cur.executemany("UPDATE downloads SET state=? WHERE id=?",
+                               ((in_flight_state, w['id']) for w in work[link]))
+            yield link
+
+    def get(link, session):
+        return fetch_pic(link, work[link][0]['pic_path'] + __part__, session)
+
+    saved, gave_up = 0, 0
+    for n, (link, rsp) in enumerate(peep.window_getter(starting(work.keys()), in_flight=in_flight,
+                                                       tries=2, get=get, ok=__dl_ok__), 1):
+        rows = work[link]
+        part = rows[0]['pic_path'] + __part__
+        error, hopeless = None, False
+        if rsp is None:
+            error = "no response"
+        elif rsp.status_code in (200, 206):
+            error = verify_pic(part, rsp.expected)
+            # a picture that's only short is kept for resuming, anything else wrong starts over
+            if error and not (rsp.expected and os.path.getsize(part) < rsp.expected):
+                os.remove(part)
+        else:
+            # a stand-in server has no pictures to give, so its '404' doesn't count against one
+            error, hopeless = "HTTP {}".format(rsp.status_code), rsp.status_code == 404 and not webcache.__stand_in__
+        if error is None:
             try:
-                with open(lp, 'wb') as fob:
-                    for chunk in rsp.iter_content(1024):
-                        fob.write(chunk)
-                db.cur.execute(usql, (os.path.join(lp.split(os.path.sep)[-2:]), dbid))
-                successes += 1
-            except Exception as e:
-                print(e)
-                print("{} had good response, but is still screwy!".format(lp))
-        if rsp.status_code == 404:
-            skip.append(dbid)
-
+                for w in rows[1:]:
+                    shutil.copyfile(part, w['pic_path'])
+                if os.path.isfile(rows[0]['pic_path']) and 'nt' in os.name:
+                    os.remove(rows[0]['pic_path'])
+                os.rename(part, rows[0]['pic_path'])
+            except (IOError, OSError) as e:
+                print("{} had good response, but is still screwy! {}".format(rows[0]['pic_path'], e))
+                error = str(e)
+        for w in rows:
+            if error is None:
+                manifest.note(w['pic_path'])
+                db.cur.execute(usql, (os.path.join(*w['pic_path'].split(os.path.sep)[-2:]), w['id']))
+                db.cur.execute(qsql, (done, None, w['id']))
+                saved += 1
+                continue
+            stop = hopeless or w['attempts'] + 1 >= max_attempts
+            gave_up += stop
+            db.cur.execute(qsql, (failed if stop else pending, error, w['id']))
+        if not n % commit_every:
+            db.con.commit()
+            print("{:7} of {} downloads tried, {} saved".format(n, len(work), saved))
     db.con.commit()
-    return skip, work_pool - successes
+    return saved, gave_up
 
 
-def main():
+def main(changed_only=False):
+    """
+    changed_only: just link up the sets holding new or changed cards from the latest populate run
+    """
     peep.card_db.add_columns(peep.__cards_t__, __db_pic_col__)
     peep.card_db.add_columns(peep.__cards_t__, __db_link__)
     peep.set_db.add_columns(peep.__sets_t__, __db_card_count__)
     #print peep.card_db.show_columns(peep.__cards_t__)
-    it = peep.card_db.cur.execute("SELECT id, name, code, pic_link FROM cards").fetchall()
-
-    populate_links(card_counts(__db_card_count__.keys()[0]))
 
-    trying = 7
-    repeat_tries = 10
-    remains = len(it)
-    old_remain, old_remain_count = 0, 0
-    print("{} starting line items".format(remains))
+    changes = peep.changed_cards() if changed_only else None
+    populate_links(card_counts(__db_card_count__.keys()[0], codes=changes))
 
-    baddies = []
-    #
-    print("attempting {} per download run:".format(trying))
-
-    while (remains - len(baddies)) > 0:
-        print("{:7} remain,   {:7} baddies".format(remains, len(baddies)))
-        baddies, remains = download_pics(attempt=trying, skip=baddies, remaining=remains)
-        if remains == old_remain:
-            old_remain_count += 1
-        else:
-            old_remain_count = 0
-        if old_remain_count > repeat_tries:
-            print(" Definition of Insanity. Not making progress. Breaking out!")
-            break
-        old_remain = remains
+    queue_downloads()
+    saved, gave_up = download_queue()
+    print("saved {} pictures, gave up on {}".format(saved, gave_up))
+    baddies = [r['id'] for r in dl_db.cur.execute("SELECT id FROM downloads WHERE state=?", (__dl_states__[3],))]
 
     print("\n There are {} 'bad' items in the database: \n".format(len(baddies)))
     print(" #  setcode:    card name:             local path:             web link:\n")
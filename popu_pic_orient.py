@@ -11,6 +11,11 @@ import orientation
 import pricer
 
 populate.main()
+# populate.main() already skips the unchanged sets and cards, and records the ids it changed.
+# picfinder and orientation could limit themselves to those (changed_only=True), but they're left looking at
+# everything on purpose: each already does only what's missing (sets with cards lacking pictures, pictures lacking
+# hashes), and a card whose picture failed to download last time hasn't 'changed', so changed_only would never
+# come back for it.
 picfinder.main()
 orientation.init_and_check()
 pricer.main()
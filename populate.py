@@ -10,15 +10,28 @@ uses: http://mtgjson.com/json/changelog.json to update card db entries that have
 
 after running populate.py, run picfinder.py to check magiccards.info for downloadable pictures of newly added cards
 """
+from gevent import monkey
+monkey.patch_all(thread=False, select=False)    # cooperative sockets, so the gevent greenlets below really run at once
 import os
 import path
 import json
 import sqlite3
+import hashlib
 import requests
-import grequests
-from collections import Counter
+import webcache
+import gevent
+from gevent.pool import Pool
+from gevent.lock import BoundedSemaphore
+from urlparse import urlparse
+from collections import Counter, defaultdict
+from contextlib import contextmanager, closing
 import time
 import sys
+import re
+import atexit
+import threading
+import Queue
+import zipfile
 reload(sys).setdefaultencoding("utf8")
 
 
@@ -33,10 +46,25 @@ __needs__ = os.getcwd() + os.sep + 'needs_pic_links.json'
 __jsonsets__ = 'http://mtgjson.com/json/SetCodes.json'
 __jsonupdate__ = 'http://mtgjson.com/json/changelog.json'
 __one_set__ = 'http://mtgjson.com/json/{}.json'
+__archive_chunk__ = 1 << 22     # bytes read at a time from an AllSets-style archive
 __req_limit__ = 21          # can the web server handle getting pounded by this many?
+__host_limit__ = 8          # most requests in flight to any single web host
+__retry_wait__ = 0.4        # seconds before a url's first retry, doubling for each retry after that
 __test_quant__ = 0          # set to zero for normal full run
 __max_errors__ = 0          # set positive to explore new import data
+__streaming__ = True        # ingest one set at a time, rather than holding every set in memory until the end
+__pipelined__ = True        # overlap fetching, parsing and writing in separate stages (when streaming)
+__queue_depth__ = 8         # most sets waiting between any two stages
+__batch_sets__ = 6          # most sets the writer commits together
+__journal_mode__ = 'WAL'    # write-ahead log lets readers carry on during the big upserts
+__synchronous__ = 'NORMAL'  # 'FULL' is sqlite's (slower) default, 'OFF' is faster still but risks corruption
+__upsert__ = sqlite3.sqlite_version_info >= (3, 24, 0)     # older sqlite lacks 'ON CONFLICT DO UPDATE'
+__attach__ = {__sqlsets__: (__sqlcards__, 'sets')}          # the sets file rides on the cards file's connection
 __last_update__ = os.getcwd() + os.sep + 'last_update.json'
+__changed__ = os.getcwd() + os.sep + 'changed_ids.json'
+__hash_col__ = u'row_hash'  # content hash stored next to each card and set, so unchanged ones can be skipped
+__audit__ = bool(os.environ.get('CARDSNAKE_AUDIT'))     # record every statement, then report on its query plan
+__sql_words__ = {'IS', 'NOT', 'NULL', 'AND', 'OR', 'IN', 'LIKE', 'GLOB', 'BETWEEN', 'COLLATE', 'NOCASE'}  # not columns
 __set_hdr_excluded__ = [u'cards', u'booster']
 __cards_hdr_excluded__ = [u'booster', u'foreignNames']
 __newness__ = [u"newSetFiles", u"updatedSetFiles"]
@@ -55,44 +83,239 @@ __types__ = {"<type 'list'>": 'json',
              "<type 'buffer'>": 'BLOB'}
 
 
+class RawJson (str):
+    """ the undecoded text of a json column, as handed back for columns selected as 'name [lazyjson]' """
+
+
+class LazyRow (object):
+    """
+    an opt-in stand-in for sqlite3.Row that keeps json columns as raw text until a field is actually
+    looked at, then decodes (and keeps) just that one. Use it through DBMagic.project()
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index     # {'column-name': position, ...} shared by all rows of a query
+        self._values = list(values)
+
+    def __getitem__(self, key):
+        i = self._index[key] if isinstance(key, basestring) else key
+        v = self._values[i]
+        if isinstance(v, RawJson):
+            v = self._values[i] = json.loads(v)
+        return v
+
+    def keys(self):
+        return sorted(self._index, key=self._index.get)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self._values)))
+
+    def __repr__(self):
+        return "LazyRow({})".format(self._values)
+
+
+def lazy_rows():
+    """ a row_factory making LazyRow objects; all the rows of one cursor share a single name-to-position map """
+    index = {}
+
+    def factory(cursor, row):
+        if not index:
+            index.update((d[0], n) for n, d in enumerate(cursor.description))
+        return LazyRow(index, row)
+    return factory
+
+
+_connections = {}   # {path to a database file: the one sqlite3.Connection shared by everything in this process}
+_checked = set()    # (database file, table) pairs whose schema has already been checked in this process
+_audited = {}       # {sql statement: (first parameters seen, database file, times run)} when __audit__ is on
+
+
+class AuditCursor (sqlite3.Cursor):
+    """ a cursor that notes down each statement (and a sample of its parameters) for audit() """
+    def note(self, sql, params, times=1):
+        was = _audited.get(sql, (params, getattr(self, 'DBfn', None), 0))
+        _audited[sql] = (was[0], was[1], was[2] + times)
+
+    def execute(self, sql, params=()):
+        self.note(sql, params)
+        return super(AuditCursor, self).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            self.note(sql, seq_of_params[0], len(seq_of_params))
+        return super(AuditCursor, self).executemany(sql, seq_of_params)
+
+
+def connection(fn):
+    """
+    the shared connection for database file 'fn', opened on first use. A file listed in __attach__
+    doesn't get its own connection: it is ATTACHed to its host file's connection under a schema name.
+    Returns: (sqlite3.Connection, schema name for the tables of 'fn')
+    """
+    host, schema = __attach__.get(fn, (fn, 'main'))
+    if host not in _connections:
+        if not os.path.isdir(os.path.dirname(host)):
+            os.makedirs(os.path.dirname(host))
+        sqlite3.register_converter("json", json.loads)
+        sqlite3.register_converter("lazyjson", RawJson)
+        sqlite3.register_adapter(list, json.dumps)
+        sqlite3.register_adapter(dict, json.dumps)
+        con = sqlite3.connect(host, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+        con.row_factory = sqlite3.Row
+        con.text_factory = sqlite3.OptimizedUnicode
+        con.execute('''PRAGMA main.journal_mode={}'''.format(__journal_mode__))
+        con.execute('''PRAGMA main.synchronous={}'''.format(__synchronous__))
+        _connections[host] = con
+    con = _connections[host]
+    if schema not in [a[1] for a in con.execute('''PRAGMA database_list''').fetchall()]:
+        con.commit()
+        con.execute('''ATTACH DATABASE ? AS {}'''.format(schema), (fn,))
+        con.execute('''PRAGMA {}.journal_mode={}'''.format(schema, __journal_mode__))
+        con.execute('''PRAGMA {}.synchronous={}'''.format(schema, __synchronous__))
+    return con, schema
+
+
 class DBMagic (object):
     """
     DBcolumns = {db_tablename: '''CREATE TABLE db_tablename (column_name1 data_type PRIMARY KEY?,
                                 column_name2 data_type, )''', ...}
+    DBaddcolumns = {db_tablename: {'column_name3': data_type, ...}, ...} extra columns the tables should have
+    DBindexes = {db_tablename: ['column_name2', 'column_name2, column_name3',
+                                'column_name3 WHERE column_name1 IS NULL'], ...}
+                secondary indexes, built as soon as (and whenever) all of their columns exist
+    DBtriggers = {db_tablename: {'trigger_name': 'AFTER INSERT ON db_tablename BEGIN ... END', ...}, ...}
+                triggers, made along with the tables (once all of this DBMagic's tables exist)
     user: get the columns from the json entry for a card, or make up your own
+    Nothing touches the database file until the first use of .con or .cur. Every DBMagic on the same
+    file shares one connection (with its own cursor), and the table checks are run once per process.
     """
-    def __init__(self, DBfn=None, DBcolumns=None, DB_DEBUG=False):
+    def __init__(self, DBfn=None, DBcolumns=None, DB_DEBUG=False, DBaddcolumns=None, DBindexes=None, DBtriggers=None):
         self.DB_DEBUG = DB_DEBUG
         self.DBfn = DBfn
         self.DBcolumns = DBcolumns
+        self.DBaddcolumns = DBaddcolumns or {}
+        self.DBindexes = DBindexes or {}
+        self.DBtriggers = DBtriggers or {}
         if self.DBfn is None:
             self.DBfn = os.path.join(os.path.expanduser('~'), 'Desktop', "MagicDB", __sqlext__)
             print("WARNING, creating/using a default database: {}".format(self.DBfn))
-        if not os.path.isdir(os.path.dirname(self.DBfn)):
-            os.makedirs(os.path.dirname(self.DBfn))
-        sqlite3.register_converter("json", json.loads)
-        sqlite3.register_adapter(list, json.dumps)
-        sqlite3.register_adapter(dict, json.dumps)
-        self.con = sqlite3.connect(self.DBfn, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-        self.con.row_factory = sqlite3.Row
-        self.con.text_factory = sqlite3.OptimizedUnicode
-        self.cur = self.con.cursor()
+        self._con, self._cur, self.schema = None, None, 'main'
+        self.rate = 0.0     # rows per second achieved by the latest add_data()
+        self.written = [0, 0.0]     # rows and seconds of every add_data() so far, for the overall rows per second
+        self.trackers = {}  # {table: ColumnTracker} learned schemas, kept for the life of the process
         self.newDB = False
-        # check that tables exist. if not, make them
-        for t, v in self.DBcolumns.viewitems():
-            if not self.cur.execute('''PRAGMA table_info ('{}')'''.format(t)).fetchall():
-                self.cur.execute(v)
-                self.con.commit()
-                print("Created new table: {}".format(t))
+
+    @property
+    def con(self):
+        if self._con is None:
+            self.open()
+        return self._con
+
+    @property
+    def cur(self):
+        if self._cur is None:
+            self.open()
+        return self._cur
+
+    @property
+    def tables(self):
+        return [a[0] for a in self.cur.execute('''SELECT name FROM {}.sqlite_master WHERE type='table' '''
+                                               .format(self.schema)).fetchall()]
+
+    def open(self):
+        """ hook up to the shared connection, then check (once per process) that the tables exist. if not, make them """
+        self._con, self.schema = connection(self.DBfn)
+        self._cur = self.cursor()
+        checking = [t for t in self.DBcolumns if (self.DBfn, t) not in _checked]
+        for t in checking:
+            v = self.DBcolumns[t]
+            if not self.show_columns(t):
+                if self.schema != 'main':
+                    v = v.replace('CREATE TABLE {}'.format(t), 'CREATE TABLE {}.{}'.format(self.schema, t), 1)
+                self._cur.execute(v)
+                self._con.commit()
+                print("Created new table: {} in file: {}".format(t, self.DBfn))
                 self.newDB = True
-            else:
-                print("using existing table: {} ".format(t))
-            print("in file: {}".format(self.DBfn))
-        self.tables = [a[0] for a in
-                       self.cur.execute('''SELECT name FROM sqlite_master WHERE type='table' ''').fetchall()]
+            elif self.DB_DEBUG:
+                print("using existing table: {} in file: {}".format(t, self.DBfn))
+            if t in self.DBaddcolumns:
+                self.add_columns(t, self.DBaddcolumns[t])
+            self.build_indexes(t)
+        for t in checking:
+            self.build_triggers(t)
+            _checked.add((self.DBfn, t))
+
+    def cursor(self):
+        """ a new cursor on the shared connection; an AuditCursor when __audit__ is on """
+        if not __audit__:
+            return self.con.cursor()
+        cur = self.con.cursor(AuditCursor)
+        cur.DBfn = self.DBfn
+        return cur
+
+    def pragmas(self, journal_mode=__journal_mode__, synchronous=__synchronous__):
+        """
+        tune the write-speed vs. crash-safety trade-off for this database file. Module defaults are set above.
+        """
+        self.cur.execute('''PRAGMA {}.journal_mode={}'''.format(self.schema, journal_mode))
+        self.cur.execute('''PRAGMA {}.synchronous={}'''.format(self.schema, synchronous))
+
+    @contextmanager
+    def transaction(self):
+        """
+        run everything inside the 'with' block as one explicit transaction: COMMIT on the way out, ROLLBACK on errors.
+        The sqlite3 module's implicit transactions are switched off meanwhile so it can't commit halfway.
+        """
+        self.con.commit()
+        isolation, self.con.isolation_level = self.con.isolation_level, None
+        self.cur.execute('''BEGIN''')
+        try:
+            yield self.cur
+        except BaseException:
+            self.cur.execute('''ROLLBACK''')
+            raise
+        else:
+            self.cur.execute('''COMMIT''')
+        finally:
+            self.con.isolation_level = isolation
+
+    def column_types(self, tablename):
+        """ returns {'column-name': 'declared sqlite-data-type', ...} """
+        return {t[1]: t[2] for t in
+                self.cur.execute('''PRAGMA {}.table_info ('{}')'''.format(self.schema, tablename)).fetchall()}
 
     def show_columns(self, tablename):
-        return [t[1] for t in self.cur.execute('''PRAGMA table_info ('{}')'''.format(tablename)).fetchall()]
+        return [t[1] for t in
+                self.cur.execute('''PRAGMA {}.table_info ('{}')'''.format(self.schema, tablename)).fetchall()]
+
+    def project(self, tablename, columns=None, where='', params=()):
+        """
+        projection helper: select just the wanted columns, getting back LazyRow objects whose json columns
+        are only decoded when (and if) a field is accessed. Bulk scans stop paying for unused json parsing.
+        Parameters
+        ----------
+        columns: list of column names, or None for all of them
+        where: optional sql following 'WHERE', with '?' placeholders for 'params'
+
+        Returns
+        -------
+        a cursor to iterate over or fetch from
+        """
+        types = self.column_types(tablename)
+        if columns is None:
+            columns = sorted(types)
+        picks = ['''{0} AS "{0} [lazyjson]"'''.format(c) if types.get(c) == 'json' else c for c in columns]
+        sql = '''SELECT {} FROM {}.{}'''.format(", ".join(picks), self.schema, tablename)
+        if where:
+            sql += ''' WHERE ''' + where
+        cur = self.cursor()
+        cur.row_factory = lazy_rows()
+        return cur.execute(sql, params)
 
     def add_columns(self, tableup, column_map):
         """
@@ -105,99 +328,322 @@ class DBMagic (object):
         present_columns = self.show_columns(tableup)
         for newcol, sql_dtype in column_map.viewitems():
             if newcol not in present_columns:
-                self.cur.execute('''ALTER TABLE {} ADD {} {}'''.format(tableup, newcol, sql_dtype))
+                self.cur.execute('''ALTER TABLE {}.{} ADD {} {}'''.format(self.schema, tableup, newcol, sql_dtype))
                 if self.DB_DEBUG:
                     print("added column: '{}' of type: '{}' to table: {}".format(newcol, sql_dtype, tableup))
         self.con.commit()
+        self.build_indexes(tableup)
+
+    def build_indexes(self, tablename):
+        """
+        make the DBindexes declared for 'tablename'. An index on columns the table doesn't have yet (indexed, or named
+        in its WHERE clause) is skipped quietly; add_columns() calls back here, so it gets built once they show up.
+        Returns: list of the index names that were created just now
+        """
+        present, made = None, []
+        existing = set(a[0] for a in self.cur.execute('''SELECT name FROM {}.sqlite_master WHERE type='index' '''
+                                                      .format(self.schema)).fetchall())
+        for spec in self.DBindexes.get(tablename, []):
+            columns, _, partial = spec.partition(' WHERE ')
+            columns = [c.strip() for c in columns.split(',')]
+            name = "idx_{}_{}".format(tablename, "_".join(columns)) + ("_partial" if partial else "")
+            if name in existing:
+                continue
+            if present is None:
+                present = set(self.show_columns(tablename))
+            bare = re.sub(r"'(?:[^']|'')*'", " ", partial)     # words inside 'string literals' aren't columns
+            named = set(w for w in re.findall(r'[A-Za-z_]\w*', bare) if w.upper() not in __sql_words__)
+            if not present.issuperset(columns) or not present.issuperset(named):
+                continue
+            self.cur.execute('''CREATE INDEX IF NOT EXISTS {}.{} ON {}({}){}'''
+                             .format(self.schema, name, tablename, ", ".join(columns),
+                                     " WHERE " + partial if partial else ""))
+            made.append(name)
+            if self.DB_DEBUG:
+                print("built index: {} on table: {}".format(name, tablename))
+        if made:
+            self.con.commit()
+        return made
+
+    def build_triggers(self, tablename):
+        """ make the DBtriggers declared for 'tablename' that aren't there yet. Returns: list of their names """
+        existing = set(a[0] for a in self.cur.execute('''SELECT name FROM {}.sqlite_master WHERE type='trigger' '''
+                                                      .format(self.schema)).fetchall())
+        made = [name for name in self.DBtriggers.get(tablename, {}) if name not in existing]
+        for name in made:
+            self.cur.execute('''CREATE TRIGGER IF NOT EXISTS {}.{} {}'''
+                             .format(self.schema, name, self.DBtriggers[tablename][name]))
+            if self.DB_DEBUG:
+                print("built trigger: {} on table: {}".format(name, tablename))
+        if made:
+            self.con.commit()
+        return made
+
+    def tracker(self, tablename, exclusions=None):
+        """
+        the one ColumnTracker for 'tablename'. Use it as 'db.tracker(table).learn(rows)' in place of
+        'db.add_columns(table, column_type_parser(rows))'
+        """
+        if tablename not in self.trackers:
+            self.trackers[tablename] = ColumnTracker(db=self, table=tablename)
+        self.trackers[tablename].seen.update(exclusions or [])
+        return self.trackers[tablename]
+
+    def upsert_sql(self, tbl, columns, key_column, masked=False):
+        """
+        Returns
+        -------
+        list of parameterized statements that insert or update a row holding exactly 'columns'.
+        Parameters are the row values in 'columns' order. The second statement only shows up
+        on old sqlite versions: an UPDATE that takes the key value once more on the end.
+        masked: (needs UPSERT) rows may lack some of the columns. Their missing values are passed as NULL, followed
+        by one more parameter, a string of '1's and '0's saying which columns the row really has, so an
+        existing row keeps its values for the others.
+        """
+        tbl = "{}.{}".format(self.schema, tbl)
+        if masked and __upsert__ and key_column in columns:
+            updates = ", ".join("{0}=CASE WHEN substr(?{1}, {2}, 1)='1' THEN excluded.{0} ELSE {0} END"
+                                .format(c, len(columns) + 1, i + 1) for i, c in enumerate(columns) if c != key_column)
+            return ['''INSERT INTO {}({}) VALUES({}) ON CONFLICT({}) DO {}'''
+                    .format(tbl, ", ".join(columns), ", ".join("?{}".format(i + 1) for i in xrange(len(columns))),
+                            key_column, "UPDATE SET " + updates if updates else "NOTHING")]
+        if __upsert__ and key_column in columns:
+            updates = ", ".join("{0}=excluded.{0}".format(c) for c in columns if c != key_column)
+            return ['''INSERT INTO {}({}) VALUES({}) ON CONFLICT({}) DO {}'''
+                    .format(tbl, ", ".join(columns), ", ".join("?" * len(columns)), key_column,
+                            "UPDATE SET " + updates if updates else "NOTHING")]
+        sqls = ['''INSERT OR IGNORE INTO {}({}) VALUES({})'''
+                .format(tbl, ", ".join(columns), ", ".join("?" * len(columns)))]
+        if key_column in columns:
+            sqls.append('''UPDATE {} SET {} WHERE {}=?'''.format(tbl, ", ".join(c + "=?" for c in columns), key_column))
+        return sqls
 
     def add_data(self, data, tbl, key_column=None):
         """
         populate database with list-of-dict values for dict.keys() that are in db-columns
         Parameters
         ----------
-        data - list of dict cum json objects whose wanted keys have been made DB column names
+        data - list (or any iterable) of dict cum json objects whose wanted keys have been made DB column names
         tbl - db_table to which we add this data
         key - the sqlite PRIMARY KEY that the table index is being done on
 
         Returns
         -------
-        side effect = database entry. Made an UPSERT from strings that accepts any number of key: vals
-        as long as keys are column names. sqlite3 has no native UPSERT command.
+        side effect = database entry. All the rows go in with one re-usable, parameterized UPSERT via executemany(),
+        inside a single transaction. Rows lacking some of the columns leave those alone (see upsert_sql's 'masked');
+        on sqlite too old for that, the rows are grouped by the set of columns they carry, a statement per group.
+        (index of the last row, count of rows that errored)
         """
         n, error_count = -1, 0
         if key_column is None:
-            hdrs = self.cur.execute('''PRAGMA table_info ({})'''.format(tbl)).fetchall()
+            hdrs = self.cur.execute('''PRAGMA {}.table_info ({})'''.format(self.schema, tbl)).fetchall()
             for h in hdrs:
                 if bool(h[5]):
                     key_column = h[1]
                     if self.DB_DEBUG:
                         print("guessing primary key is: {}".format(key_column))
 
-        approved_columns = self.show_columns(tbl)
-
-        def hunk(c):
-            return c + "=(?)"
-
+        approved_columns = set(self.show_columns(tbl))
+        start = time.time()
+        groups = defaultdict(list)
         for n, line in enumerate(data):
-            line_item = {k: v for k, v in line.viewitems() if k in approved_columns}
-            SQL1 = '''INSERT OR IGNORE INTO {}({}) VALUES({})'''.format(str(tbl), ', '.join(line_item.keys()),
-                                                                        ':' + ', :'.join(line_item.keys()))
-            SQL2 = '''UPDATE {} SET {} WHERE changes()=0 and {}=("{}")'''\
-                .format(str(tbl), ", ".join(map(hunk, line_item.keys())), key_column, line_item[key_column])
-            try:
-                self.cur.execute(SQL1, line_item)
-                self.cur.execute(SQL2, line_item.values())
-            except (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
-                error_count += 1
-                print("error: {} *****table: {} ***  row#{}   #items={}  >>> {}  ***"
-                      .format(error_count, tbl, n, len(line_item), e))
-                print(SQL1, SQL2)
-                print(line_item)
-                if error_count > __max_errors__:
-                    print("** data entry has too many problems to ignore. exiting, harshly **")
-                    exit(1)
-                continue
-        self.con.commit()
+            columns = tuple(sorted(k for k in line.viewkeys() if k in approved_columns))
+            groups[columns].append(line)
+        masked = len(groups) > 1 and __upsert__ and all(key_column in c for c in groups)
+        if masked:
+            # one batch, holding every column any row has
+            columns = tuple(sorted(set(c for cols in groups for c in cols)))
+            groups = {columns: [line for lines in groups.viewvalues() for line in lines]}
+
+        with self.transaction() as cur:
+            for columns, lines in groups.viewitems():
+                sqls = self.upsert_sql(tbl, columns, key_column, masked=masked)
+                if masked:
+                    values = [[line.get(c) for c in columns] + ["".join('1' if c in line else '0' for c in columns)]
+                              for line in lines]
+                else:
+                    values = [[line[c] for c in columns] for line in lines]
+                keyed = [v + [line[key_column]] for v, line in zip(values, lines)] if len(sqls) > 1 else values
+                batches = zip(sqls, [values, keyed])
+                try:
+                    for sql, params in batches:
+                        cur.executemany(sql, params)
+                    continue
+                except (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+                    if self.DB_DEBUG:
+                        print("bulk upsert of {} rows failed ({}), going row-by-row".format(len(lines), e))
+                # find the troublemakers one row at a time so the good rows still get in
+                for i, line in enumerate(lines):
+                    try:
+                        for sql, params in batches:
+                            cur.execute(sql, params[i])
+                    except (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+                        error_count += 1
+                        print("error: {} *****table: {} ***  #items={}  >>> {}  ***"
+                              .format(error_count, tbl, len(columns), e))
+                        print(sqls)
+                        print(line)
+                        if error_count > __max_errors__:
+                            print("** data entry has too many problems to ignore. exiting, harshly **")
+                            exit(1)
+        elapsed = max(time.time() - start, 1e-6)
+        self.rate = (n + 1) / elapsed
+        self.written = [self.written[0] + n + 1, self.written[1] + elapsed]
+        if self.DB_DEBUG:
+            print("upserted {} rows in {} groups into {} in {:.2f}s ({:.0f} rows/s)"
+                  .format(n + 1, len(groups), tbl, elapsed, self.rate))
         return n, error_count
 
 
+class ColumnTracker (object):
+    """
+    learns column names and their sqlite types in a single pass while rows stream by.
+    The learned schema persists in the table itself: a tracker starts out knowing every column the table
+    already has (and every excluded key), so a re-run only pays to type the keys it has never seen before.
+    """
+    def __init__(self, db=None, table=None, exclusions=None, types_map=None):
+        self.db = db
+        self.table = table
+        self.types_map = types_map or __types__
+        self.known = {}
+        if db is not None:
+            self.known = db.column_types(table)
+        self.seen = set(self.known.viewkeys()) | set(exclusions or [])
+        self.new = {}
+
+    def observe(self, row):
+        """ type any keys of this row not seen before. Returns the row untouched """
+        for k in row:
+            if k not in self.seen:
+                try:
+                    self.new[k] = self.types_map[str(type(row[k]))]
+                except KeyError as err:
+                    print("{} - is the key, so add to the python-to-sqlite type definitions".format(err))
+                    print("PROBLEM: {}".format(row[k]))
+                    exit()
+                self.seen.add(k)
+        return row
+
+    def watch(self, rows):
+        """ generator stage: passes rows through, learning their columns on the way """
+        for row in rows:
+            yield self.observe(row)
+
+    def flush(self):
+        """
+        add the newly learned columns to the table (when there is one)
+        Returns: {'column-name': 'sqlite-data-type', ...} of only the new columns
+        """
+        fresh, self.new = self.new, {}
+        if fresh and self.db is not None:
+            self.db.add_columns(self.table, fresh)
+        self.known.update(fresh)
+        return fresh
+
+    def learn(self, rows):
+        for row in rows:
+            self.observe(row)
+        return self.flush()
+
+
 createstr = '''CREATE TABLE {} ({} TEXT PRIMARY KEY)'''
 set_db = DBMagic(DBfn=__sqlsets__,
                  DBcolumns={__sets_t__: createstr.format(__sets_t__, __sets_key__)},
                  DB_DEBUG=DEBUG)
 card_db = DBMagic(DBfn=__sqlcards__,
                   DBcolumns={__cards_t__: createstr.format(__cards_t__, __cards_key__)},
+                  DBindexes={__cards_t__: ['code']},
                   DB_DEBUG=DEBUG)
 
 
-def asynch_getter(unsent, groupsize_limit=None, DBG=DEBUG):
+def audit(statements=None, show_all=False):
     """
+    runs EXPLAIN QUERY PLAN on each statement issued so far (needs __audit__ on, eg: CARDSNAKE_AUDIT=1)
+    and points out the full-table scans. A scan behind a WHERE clause is a missing index; a scan with
+    no WHERE clause is just reading the whole table.
     Parameters
     ----------
-    unsent: generator-prepared requests objects that are not yet responses
-    groupsize_limit: can keep us from spamming web server. 12-at-a-time works
+    statements: {sql: (params, database file, times run)}, defaults to everything recorded in this process
+    show_all: print the plans that look fine too
 
     Returns
     -------
-    flat list of 'response' objects from each URL contained in unsent
-    """
-    if groupsize_limit is None:
-        groupsize_limit = len(unsent)
-    d = []
-    while unsent:
-        bunch = []
-        groupsize = min(len(unsent), groupsize_limit)
-        for x in xrange(groupsize):
-            bunch.append(unsent.pop())
-        if DBG:
-            print("requesting from {} urls".format(groupsize))
-        d.extend(grequests.map(bunch))
-    return d
+    list of (sql, times run, plan detail) for the statements that scan a whole table
+    """
+    flagged = []
+    for sql, (params, fn, times) in sorted((statements or _audited).viewitems()):
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT')) or 'sqlite_master' in sql:
+            continue
+        try:
+            plan = [p[-1] for p in connection(fn or __sqlcards__)[0]
+                    .execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError) as e:
+            print("can't explain: {} ({})".format(" ".join(sql.split()), e))
+            continue
+        scans = [p for p in plan if p.startswith('SCAN') and 'USING' not in p]
+        flagged.extend((sql, times, p) for p in scans)
+        if scans or show_all:
+            why = "no index used: " if re.search(r'\bWHERE\b', sql, re.I) else "no WHERE: "
+            print("{:>7} x {}".format(times, " ".join(sql.split())))
+            for p in plan:
+                print("    {}{}".format("FULL SCAN, " + why if p in scans else "", p))
+    return flagged
+
+
+if __audit__:
+    atexit.register(audit)
+
+
+def window_getter(urls, in_flight=__req_limit__, per_host=__host_limit__, tries=8, backoff=__retry_wait__, DBG=DEBUG,
+                  get=None, ok=(200, 404)):
+    """
+    a sliding window of requests: as each one finishes, the next url is started, so 'in_flight' are always
+    going (no more than 'per_host' of them to one web host). Each url is retried on its own, with exponential
+    backoff, so a straggler or a failure never holds up the rest.
+    Parameters
+    ----------
+    urls: iterable of url strings (consumed lazily)
+    get: function(url, session) returning a response, in place of webcache.get (eg for big one-time downloads,
+         like pictures, that shouldn't be cached)
+    ok: the status codes that are an answer; anything else is tried again (a 'get' that resumes wants 206 here)
+
+    Returns
+    -------
+    generator of (url, response) in order of completion. response is None if every try raised an error.
+    """
+    gates = defaultdict(lambda: BoundedSemaphore(per_host))
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=per_host))
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=per_host))
+
+    def fetch(url):
+        rsp = None
+        for attempt in xrange(tries):
+            with gates[urlparse(url).netloc]:
+                try:
+                    rsp = (get or webcache.get)(url, session=session)
+                except requests.RequestException as e:
+                    rsp = None
+                    if DBG:
+                        print("{} has {}".format(url, e))
+            if rsp is not None and rsp.status_code in ok:
+                break
+            if rsp is not None and rsp.status_code == 504 and webcache.__offline__:
+                break   # not in the cache, and no amount of retrying will put it there
+            if attempt == tries - 1:
+                break   # that was the last try: nothing to wait for
+            if DBG:
+                print("< {} > retrying {} ".format(tries - attempt, url) + "".join('*' * (tries - attempt)))
+            gevent.sleep(backoff * 2 ** attempt)
+        return url, rsp
+
+    for url, rsp in Pool(in_flight).imap_unordered(fetch, urls, maxsize=in_flight):
+        yield url, rsp
 
 
 def column_parser(datas, exclusions=None, DEBUG=DEBUG):
     """
-    called by column_type_parser() now. It filters out unwanted columns so they don't
+    counts how often each key shows up. It filters out unwanted columns so they don't
     get into the database. Just for peace-of-mind in avoiding bloat.
     Parameters
     ----------
@@ -224,31 +670,14 @@ def column_parser(datas, exclusions=None, DEBUG=DEBUG):
 
 def column_type_parser(datas, exclusions=None, types_map=None, DEBUG=DEBUG):
     """
-    this supplies columns & types that need to be added to db from import data
+    this supplies columns & types that need to be added to db from import data, in one pass over 'datas'
     .json is a custom sqlite type here so it can 'natively' handle nested dict & list!
     datas: your list of dict containing the data that may not have column-headers (keys) in db
     types_map: user created {'python type() output as string': 'sqlite-data-type', ...}
     - returns -
     type_defs: {'column-name': 'appropriate sqlite-data-type', ...}
     """
-    if types_map is None:
-        types_map = __types__
-    if exclusions is None:
-        exclusions = []
-
-    type_defs = {}
-    usable_columns = [c for c, quant in column_parser(datas, exclusions=exclusions).viewitems() if quant > 0]
-    for k in usable_columns:
-        for e in datas:
-            if k in e.keys():
-                try:
-                    type_defs[k] = types_map[str(type(e[k]))]
-                except KeyError as err:
-                    print("{} - is the key, so add to the python-to-sqlite type definitions".format(err))
-                    print("PROBLEM: {}".format(e[k]))
-                    exit()
-                break
-    return type_defs
+    return ColumnTracker(exclusions=exclusions, types_map=types_map).learn(datas)
 
 
 def check_for_updates(update_url, oldfn, need_all=False, DBG=DEBUG):
@@ -278,7 +707,7 @@ def check_for_updates(update_url, oldfn, need_all=False, DBG=DEBUG):
     old_version = [int(a) for a in most_recent.split(u".")]
     # get update file from web
     try:
-        req_new = requests.get(update_url).json()
+        req_new = webcache.get(update_url).json()
     except Exception as e:
         print("{}: couldn't obtain recent updates from: {}".format(e, update_url))
         return check_codes
@@ -306,27 +735,19 @@ def check_for_updates(update_url, oldfn, need_all=False, DBG=DEBUG):
     return check_codes
 
 
-def info_grubber(unsent_greq, datas=None, tries=10):
+def info_grubber(unsent, datas=None, tries=10):
     """
     don't (always) take no for an answer
+    unsent: urls, or unsent requests (anything with a .url)
     """
     if datas is None:
         datas = []
     fails = []
-    while tries:
-        fails = []
-        for n, d in enumerate(asynch_getter(unsent_greq, groupsize_limit=__req_limit__)):
-            if d.status_code == 200:
-                datas.append(d.json())
-            else:
-                fails.append(d.url)
-        if fails:
-            print("< {} > retrying {} urls ".format(tries, len(fails)) + "".join('*' * tries))
-            time.sleep(.4)
-            tries -= 1
-            unsent_greq = [grequests.get(u) for u in fails]
+    for url, rsp in window_getter((getattr(u, 'url', u) for u in unsent), tries=tries):
+        if rsp is not None and rsp.status_code == 200:
+            datas.append(rsp.json())
         else:
-            tries = 0
+            fails.append(url)
     return datas, fails
 
 
@@ -366,7 +787,7 @@ def starting_sets(sql_dbs):
     if not len(sql_dbs):
         print("setup: missing required database files: {}".format([f for f in __sqlfiles__ if f not in sql_dbs]))
         print("Getting all set codes from: {}".format(__jsonsets__))
-        setcodes = requests.get(__jsonsets__).json()
+        setcodes = webcache.get(__jsonsets__).json()
         needs = True
     print("Checking for new or updated set codes at: {}".format(__jsonupdate__))
     return list(set(setcodes + check_for_updates(__jsonupdate__, __last_update__, need_all=needs)))
@@ -385,39 +806,314 @@ def bootup():
            [unicode(p.basename()) for p in path.path(picdir).dirs()]
 
 
-def main():
+def set_stream(urls, tries=8):
+    """
+    generator stage: downloads the set files through a sliding window of requests and
+    yields each parsed set (a dict) as soon as it arrives.
+    """
+    for url, rsp in window_getter(urls, tries=tries):
+        if rsp is not None and rsp.status_code == 200:
+            yield rsp.json()
+        else:
+            print("url didn't play nice: {}".format(url))
+
+
+def archive_sets(fn, chunk=__archive_chunk__):
+    """
+    generator stage: streams the sets out of one local AllSets-style file ({set-code: {set...}, ...}, as from
+    http://mtgjson.com/json/AllSets.json, or the .zip of it), decoding a single set at a time, so the
+    whole archive is never in memory at once. Yields each set (a dict), just like set_stream() does.
+    """
+    arc = zipfile.ZipFile(fn) if zipfile.is_zipfile(fn) else None
+    fob = arc.open(arc.namelist()[0]) if arc else open(fn, mode='rb')
+    decoder, space = json.JSONDecoder(), re.compile(r'\s*')
+    buf, pos, eof = '', 0, False
+
+    def more(pos, buf):
+        """ drop what's been used, and read in another chunk """
+        got = fob.read(chunk)
+        return 0, buf[pos:] + got, not got
+
+    def token(pos, buf, eof):
+        """ the next json value in the file, reading more of it until the value is complete """
+        while True:
+            pos = space.match(buf, pos).end()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    return value, end, buf, eof
+            except ValueError:
+                if eof:
+                    raise
+            pos, buf, eof = more(pos, buf)
+
+    def punctuation(pos, buf, eof):
+        """ the next non-space character """
+        while True:
+            pos = space.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1], pos + 1, buf, eof
+            pos, buf, eof = more(pos, buf)
+
+    with closing(arc) if arc else fob, fob:
+        mark, pos, buf, eof = punctuation(pos, buf, eof)
+        if mark != '{':
+            raise ValueError("{} isn't a json object of sets".format(fn))
+        while True:
+            mark, pos, buf, eof = punctuation(pos, buf, eof)
+            if mark in ('}', ''):   # an empty archive
+                break
+            code, pos, buf, eof = token(pos - 1, buf, eof)
+            mark, pos, buf, eof = punctuation(pos, buf, eof)
+            setdata, pos, buf, eof = token(pos, buf, eof)
+            setdata.setdefault(__sets_key__, code)
+            yield setdata
+            mark, pos, buf, eof = punctuation(pos, buf, eof)
+            if mark != ',':
+                break
+
+
+def content_hash(obj):
+    """ sha1 hex digest of a json-able object, stable no matter the key order """
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def fresh_cards(setdata, force=False):
+    """
+    compares content hashes against those already stored for this set and its cards.
+    setdata: one parsed mtgjson set. It (and each card that is new or changed) gets a 'row_hash' added.
+
+    Returns
+    -------
+    list of only the cards that are new or changed, or None when the whole set is unchanged (unless 'force')
+    """
+    if __hash_col__ not in setdata:
+        hash_rows(setdata)
+    old = set_db.cur.execute("SELECT {} FROM {} WHERE {}=?".format(__hash_col__, __sets_t__, __sets_key__),
+                             (setdata[__sets_key__],)).fetchone()
+    if old and old[0] == setdata[__hash_col__] and not force:
+        return None
+    try:
+        known = {k: h for k, h in card_db.cur.execute("SELECT {}, {} FROM {} WHERE code=?"
+                                                      .format(__cards_key__, __hash_col__, __cards_t__),
+                                                      (setdata[__sets_key__],)).fetchall()}
+    except sqlite3.OperationalError:
+        known = {}      # brand new table, without even a 'code' column yet
+    return [card for card in setdata[__cards_dk__]
+            if force or known.get(card.get(__cards_key__)) != card[__hash_col__]]
+
+
+def hash_rows(setdata):
+    """
+    the cpu-heavy half of fresh_cards(), needing no database: puts a 'row_hash' on the set and on each of its
+    cards (which also get their 'code'). Returns setdata
+    """
+    setdata[__hash_col__] = content_hash(setdata)
+    for card in deckify([setdata]):
+        card[__hash_col__] = content_hash(card)
+    return setdata
+
+
+def ingest_sets(sets, force=False):
+    """
+    generator stage: infers the columns for, then writes, one set (and its new or changed cards) at a time,
+    so memory only ever holds about one set's worth of data. Sets and cards whose content hash is
+    unchanged since the last import are skipped.
+    sets: iterable of parsed mtgjson set dicts, like the output of set_stream()
+    yields: (set-code, list of the card ids written, quantity of import errors)
+    """
+    set_db.add_columns(__sets_t__, {__hash_col__: 'TEXT'})
+    card_db.add_columns(__cards_t__, {__hash_col__: 'TEXT'})
+    for setdata in sets:
+        deck = fresh_cards(setdata, force=force)
+        if deck is None:
+            yield setdata[__sets_key__], [], 0
+            continue
+        set_db.tracker(__sets_t__, exclusions=__set_hdr_excluded__).learn([setdata])
+        card_db.tracker(__cards_t__, exclusions=__cards_hdr_excluded__).learn(deck)
+        a, b = card_db.add_data(deck, __cards_t__, key_column=__cards_key__)
+        c, d = set_db.add_data([setdata], __sets_t__, key_column=__sets_key__)
+        yield setdata[__sets_key__], [card[__cards_key__] for card in deck], b + d
+
+
+def pipeline(urls, tries=8, depth=__queue_depth__, batch=__batch_sets__, force=False):
+    """
+    ingest_sets(set_stream(urls)) as two overlapping stages joined by a bounded queue:
+    a fetch thread (the sliding window of requests) that also does the json decoding and content hashing,
+    and the calling thread as the one and only sqlite writer, which commits up to 'batch' sets at a time.
+    sqlite lets go of the GIL while it writes, so the parsing carries on meanwhile. More parse threads don't help:
+    the parsing is pure python and they'd only take turns at the GIL (two of them were measured slower than one).
+    yields: (set-code, list of the card ids written, quantity of import errors), the errors of each
+    batch being counted against its first set
+    """
+    done = object()
+    parsed = Queue.Queue(maxsize=depth)
+    busy = Counter()    # seconds of work done by each stage
+
+    def fetcher():
+        try:
+            start = time.time()
+            for url, rsp in window_getter(urls, tries=tries):
+                if rsp is None or rsp.status_code != 200:
+                    print("url didn't play nice: {}".format(url))
+                    continue
+                busy['fetch'] += time.time() - start
+                start = time.time()
+                try:
+                    setdata = hash_rows(rsp.json())
+                except ValueError as e:
+                    print("{} didn't parse: {}".format(rsp.url, e))
+                    continue
+                finally:
+                    busy['parse'] += time.time() - start
+                    start = time.time()
+                parsed.put(setdata)
+                start = time.time()
+        finally:
+            parsed.put(done)
+
+    stage = threading.Thread(target=fetcher, name='fetch')
+    stage.daemon = True
+    stage.start()
+
+    set_db.add_columns(__sets_t__, {__hash_col__: 'TEXT'})
+    card_db.add_columns(__cards_t__, {__hash_col__: 'TEXT'})
+    wall, running = time.time(), 1
+    while running:
+        sets = []
+        while len(sets) < batch and running:
+            try:
+                setdata = parsed.get(block=not sets)
+            except Queue.Empty:
+                break
+            if setdata is done:
+                running -= 1
+            else:
+                sets.append(setdata)
+        start = time.time()
+        written, deck = [], []
+        for setdata in sets:
+            fresh = fresh_cards(setdata, force=force)
+            if fresh is None:
+                yield setdata[__sets_key__], [], 0
+                continue
+            written.append((setdata, fresh))
+            deck.extend(fresh)
+        if written:
+            set_db.tracker(__sets_t__, exclusions=__set_hdr_excluded__).learn(s for s, _ in written)
+            card_db.tracker(__cards_t__, exclusions=__cards_hdr_excluded__).learn(deck)
+            a, b = card_db.add_data(deck, __cards_t__, key_column=__cards_key__)
+            c, d = set_db.add_data([s for s, _ in written], __sets_t__, key_column=__sets_key__)
+            busy['write'] += time.time() - start
+            for n, (setdata, fresh) in enumerate(written):
+                yield setdata[__sets_key__], [card[__cards_key__] for card in fresh], 0 if n else b + d
+        else:
+            busy['write'] += time.time() - start
+    if DEBUG:
+        print("pipeline busy seconds: {}, wall-clock: {:.2f}s".format(
+            ", ".join("{} {:.2f}".format(k, v) for k, v in sorted(busy.viewitems())), time.time() - wall))
+
+
+def save_changes(changes, fn=__changed__):
+    """ changes: {set-code: [ids of new or changed cards], ...} saved for the later stages to pick up """
+    try:
+        with open(fn, mode='wb') as wob:
+            json.dump(changes, wob)
+    except Exception as e:
+        print("{}: couldn't save the changed card ids as {}".format(e, fn))
+
+
+def changed_cards(fn=__changed__):
+    """
+    the new or changed card ids from the latest run of populate.main(), which later stages (picfinder, orientation)
+    can use to limit their work.
+    Returns: {set-code: [card ids, ...], ...}, or None if there is no record of changes
+    """
+    try:
+        with open(fn, mode='rb') as fob:
+            return json.load(fob)
+    except (IOError, ValueError) as e:
+        print("{}: no changed-ids record ({})".format(e, fn))
+        return None
+
+
+def write_rates():
+    """ prints the rows per second add_data() managed over the whole run, for the cards and the sets """
+    for name, db in [(__cards_t__, card_db), (__sets_t__, set_db)]:
+        rows, seconds = db.written
+        if rows:
+            print("wrote {} rows to {} at {:.0f} rows/s".format(rows, name, rows / max(seconds, 1e-6)))
+
+
+def main(streaming=__streaming__, pipelined=__pipelined__, archive=None):
+    """
+    archive: path to a local AllSets-style .json (or .json.zip) file. When given, every set comes from it,
+    with no network traffic at all: the quick way to build a new database from scratch.
+    """
     homedir, picdir, sqldbs, picsets = bootup()
 
     if DEBUG:
         print("using existing sqlite db fns: {}".format(sqldbs))
 
-    urls = [__one_set__.format(s) for s in xando(starting_sets(sqldbs))]
-    unsent = [grequests.get(u) for u in urls[:(__test_quant__ or len(urls))]]
+    changes = {}
+    if archive:
+        print("importing all sets from: {}".format(archive))
+        sets = ingest_sets(archive_sets(archive))
+    else:
+        urls = [__one_set__.format(s) for s in xando(starting_sets(sqldbs))]
+        urls = urls[:(__test_quant__ or len(urls))]
+        sets = pipeline(urls) if pipelined else ingest_sets(set_stream(urls))
+
+    if streaming or archive:
+        set_count, card_count, error_count = 0, 0, 0
+        for code, ids, errors in sets:
+            set_count, card_count, error_count = set_count + 1, card_count + len(ids), error_count + errors
+            if ids:
+                changes[code] = ids
+            if DEBUG:
+                print("set: {} added or changed {} cards".format(code, len(ids)))
+        print("processed sets: {}, new or changed cards: {}, import errors: {}"
+              .format(set_count, card_count, error_count))
+        save_changes(changes)
+        write_rates()
+        return 1
 
-    datas, fails = info_grubber(unsent, tries=8)
+    datas, fails = info_grubber(urls, tries=8)
 
     for p in fails:
         print("url didn't play nice: {}".format(p))
 
-    # aggregate all the columns (while assigning their data-types) for each data-set
-    columns_for_sets = column_type_parser(datas, exclusions=__set_hdr_excluded__)
-    deck = deckify(datas)
-    columns_for_cards = column_type_parser(deck, exclusions=__cards_hdr_excluded__)
+    # leave out the sets and cards that haven't changed since they were last imported
+    set_db.add_columns(__sets_t__, {__hash_col__: 'TEXT'})
+    card_db.add_columns(__cards_t__, {__hash_col__: 'TEXT'})
+    deck, changed_sets = [], []
+    for setdata in datas:
+        fresh = fresh_cards(setdata)
+        if fresh is None:
+            continue
+        if fresh:
+            changes[setdata[__sets_key__]] = [card[__cards_key__] for card in fresh]
+        changed_sets.append(setdata)
+        deck.extend(fresh)
+    datas = changed_sets
 
-    if DEBUG:
-        print("'set_infos' columns to update: {}".format(columns_for_sets))
-        print("'cards' columns to update: {}".format(columns_for_cards))
+    # aggregate all the new columns (while assigning their data-types) for each data-set,
+    # adding the approved column-headers to existing tables
+    columns_for_sets = set_db.tracker(__sets_t__, exclusions=__set_hdr_excluded__).learn(datas)
+    columns_for_cards = card_db.tracker(__cards_t__, exclusions=__cards_hdr_excluded__).learn(deck)
 
-    # adding the approved column-headers to existing tables (if not already present)
-    set_db.add_columns(set_db.tables[0], columns_for_sets)
-    card_db.add_columns(card_db.tables[0], columns_for_cards)
+    if DEBUG:
+        print("'set_infos' columns updated: {}".format(columns_for_sets))
+        print("'cards' columns updated: {}".format(columns_for_cards))
 
     # should be ready to add the data to local database!
     a, b = card_db.add_data(deck, card_db.tables[0], key_column=__cards_key__)
-    print("processed cards: {}, import errors: {}".format(a+1, b))
+    print("processed new or changed cards: {}, import errors: {}".format(a+1, b))
     c, d = set_db.add_data(datas, set_db.tables[0], key_column=__sets_key__)
     print("processed sets: {}, import errors: {}".format(c+1, d))
+    save_changes(changes)
+    write_rates()
     return 1
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    exit(main(archive=(sys.argv[1:2] or [None])[0]))
\ No newline at end of file
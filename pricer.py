@@ -11,8 +11,7 @@ get the price info for all cards from mtgprice.com and cache it into local datab
 """
 
 import picfinder as pf
-import requests
-import grequests
+import webcache
 from operator import itemgetter
 import json
 import time
@@ -23,6 +22,7 @@ HOUR_DELAY = 2.0
 
 price_db = pf.peep.DBMagic(DBfn=pf.peep.__sqlcards__,
                            DBcolumns={'prices': pf.peep.createstr.format('prices', 'cardId')},
+                           DBindexes={'prices': ['set_code']},
                            DB_DEBUG=True)
 
 """
@@ -51,7 +51,7 @@ def mtgdate_map(url='http://www.mtgprice.com/magic-the-gathering-prices.jsp'):
     a, b, c = '">', '</a> </td><td>', '</td></tr><'
     foil_str = " (Foil)"
     mp = {}
-    for l in requests.get(url).content.split(splt1)[1:]:
+    for l in webcache.get(url).content.split(splt1)[1:]:
         FOIL = False
         kk, rest = l.split(a)[:2]
         name, rest = rest.split(b)
@@ -65,20 +65,16 @@ def mtgdate_map(url='http://www.mtgprice.com/magic-the-gathering-prices.jsp'):
 
 
 def async_prices(sites):
-    """ sites is the dict output of mtgdate_map()  """
-    bad_objs, bad_explanations = [], []
-
-    def handler(quest_obj, exception):
-        bad_objs.append(quest_obj)
-        bad_explanations.append(exception)
-        print("{} has {}".format(quest_obj, exception))
-
+    """ sites is the dict output of mtgdate_map(). The pages come through the web cache, like every other page """
+    pricelist, bad_objs, bad_explanations = [], [], []
     print("timer start: {}".format(time.time()))
-
-    rs = (grequests.get(u) for u in sites.keys())
-
-    pricelist = grequests.map(rs, exeption_handler=handler)
-
+    for url, rsp in pf.peep.window_getter(sites.keys()):
+        if rsp is not None and rsp.status_code == 200:
+            pricelist.append(rsp)
+            continue
+        bad_objs.append(url)
+        bad_explanations.append("no response" if rsp is None else "HTTP {}".format(rsp.status_code))
+        print("{} has {}".format(url, bad_explanations[-1]))
     return pricelist, bad_objs, bad_explanations
 
 
@@ -133,7 +129,7 @@ def prices(url):
     returns the json-encoded version of the price info underneath an mtgprices.com spoiler-list page
     """
     try:
-        return json.loads(requests.get(url).content.split('$scope.setList =  ')[1].split(";\n")[0])
+        return json.loads(webcache.get(url).content.split('$scope.setList =  ')[1].split(";\n")[0])
     except:
         # rarely the page data is missing even when requests returns something saying its okay
         print("PROBLEM WITH DATA AT: {}  \n".format(url))
@@ -152,9 +148,9 @@ def allprices(lmap, db=price_db):
         for card in pricelist:
             card['set_code'] = info[0][0][0]
         print("{:3}: adding {} items for {}".format(item_num, len(pricelist), link))
-        biglist.extend(pricelist)
+        biglist.extend(db.tracker('prices').watch(pricelist))
     print("attempting to commit {} price lines".format(len(biglist)))
-    db.add_columns('prices', pf.peep.column_type_parser(biglist))
+    db.tracker('prices').flush()
     db.add_data(biglist, 'prices', key_column=u'cardId')
     print("Done!")
     return len(biglist)
@@ -337,7 +333,7 @@ def main(dbid=pf.peep.card_db, mainDEBUG=False):
 
     # add columns if needed, then add the data
     if big_data:
-        dbid.add_columns('cards', pf.peep.column_type_parser(big_data))
+        dbid.tracker('cards').learn(big_data)
         dbid.add_data(big_data, 'cards', key_column='id')
 
 
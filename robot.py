@@ -14,6 +14,7 @@ from operator import itemgetter
 from cv2_common import Timer, draw_str
 import orientation
 import pricer
+import packstore
 
 Card = namedtuple('Card', 'name, code, id, pic_path, kp')
 
@@ -460,7 +461,7 @@ def main():
                 new_window = "{} {} | {}".format(one_card.name, one_card.code, pricestr)
                 warp = eyeball.show_card_info(new_window.split(" | "), warp, max_expansion=2.6, topleft=(5, 5))
                 cv2.imshow(new_window, cv2.drawMatchesKnn(warp, current_kp,
-                                                cv2.imread(os.path.join(pathfront, one_card.pic_path)),
+                                                packstore.imread(os.path.join(pathfront, one_card.pic_path)),
                                                   one_card.kp, matches,
                                                   outImg=np.zeros((eyeball.yc, eyeball.xc * 2, 3), dtype=np.uint8),
                                                   flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS))
@@ -11,6 +11,7 @@
 
 import cv2
 import orientation
+import manifest
 import os
 import time
 from hashlib import sha1
@@ -51,6 +52,7 @@ def pic_adder(img, db=orientation.orient_db, img_dir=None, img_name=None, img_co
     fullpath = os.path.join(img_dir, (img_code.lower() + img_name + img_format))
     unique_path = os.sep.join(fullpath.split(os.sep)[-2:])
     cv2.imwrite(fullpath, img)
+    manifest.note(fullpath)
 
     line = dict(id=img_id, code=img_code, name=img_name, pic_path=unique_path, variations=brothers)
     print("saved pic as: {}".format(fullpath))
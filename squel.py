@@ -7,8 +7,8 @@ some db-examination/debug stuff for pasting into ipython console and general con
 import sys
 reload(sys).setdefaultencoding("utf8")
 import populate as peep
+import webcache
 import pprint
-import requests
 import json
 
 
@@ -17,11 +17,12 @@ def cols(sort=True):
             's': sorted(peep.set_db.show_columns('set_infos'))}
 
 
-def rall(t='cards', db=peep.card_db):
+def rall(t='cards', db=peep.card_db, columns=None):
+    """ every row of table 't'; json columns are only decoded for the fields that get looked at """
     if t == 'sets':
         t = 'set_infos'
         db = peep.set_db
-    return db.cur.execute("SELECT * from {}".format(t)).fetchall()
+    return db.project(t, columns=columns).fetchall()
 
 
 def linknull(codes, db=None, t='cards'):
@@ -38,7 +39,7 @@ def look(row_object, *stuff):
 
 
 def mtginfo(site='http://magiccards.info/sitemap.html'):
-    ri = requests.get(site).iter_lines()
+    ri = webcache.get(site).iter_lines()
     mcimap = {}
     for i in ri:
         if '<h3>Expansions</h3>' in i:
@@ -80,7 +81,7 @@ def codeinfo():
 
 
 def listset(code):
-    rows = peep.card_db.cur.execute("SELECT * from cards where code=?", (code,)).fetchall()
+    rows = peep.card_db.project('cards', columns=['code', 'name', 'pic_link'], where="code=?", params=(code,))
     for r in rows:
         print("{}: {} {}".format(r['code'], r['name'], r['pic_link']))
 
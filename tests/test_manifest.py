@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+>> python -m unittest discover tests        from the top of the repo
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import populate as peep
+import manifest
+
+
+class MissingFolderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fs = os.path.join(self.folder, 'pics')     # never made
+        self.db = peep.DBMagic(DBfn=os.path.join(self.folder, 'cards.sqlite'), DBcolumns=manifest.manifest_db.DBcolumns)
+
+    def tearDown(self):
+        manifest._sizes.pop(self.fs, None)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_no_pictures(self):
+        self.assertEqual(manifest.refresh(self.fs, db=self.db), 0)
+        self.assertEqual(manifest.sizes(self.fs), {})
+        self.assertFalse(manifest.present(os.path.join(self.fs, 'ISD', 'isd2.jpg'), fs=self.fs))
+
+    def test_present_without_refresh(self):
+        self.assertFalse(manifest.present('ISD/isd2.jpg', fs=self.fs))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+>> python -m unittest discover tests        from the top of the repo
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+import populate as peep
+import packstore
+
+
+class FallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fs = os.path.join(self.folder, 'pics')
+        os.makedirs(os.path.join(self.fs, 'ISD'))
+        self.pic = os.path.join(self.fs, 'ISD', 'isd2.png')
+        self.im = np.random.RandomState(3).randint(0, 255, (20, 14, 3)).astype(np.uint8)
+        cv2.imwrite(self.pic, self.im)
+        # a cards database from before the manifest: the pack store's own table, nothing else
+        self.db = peep.DBMagic(DBfn=os.path.join(self.folder, 'cards.sqlite'), DBcolumns=packstore.pack_db.DBcolumns)
+        self.store = packstore.PackStore(fn=os.path.join(self.folder, 'pics.pack'), shape=(2, 2, 3), db=self.db,
+                                         fs=self.fs)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_no_pack_file(self):
+        self.assertEqual(self.store.load(), 0)
+        self.assertIsNone(self.db._con)     # nothing packed, so the database wasn't even opened
+        self.assertTrue(np.array_equal(self.store.imread(self.pic), self.im))
+
+    def test_no_manifest_table(self):
+        with open(self.store.fn, 'wb') as fob:
+            fob.write('\0' * self.store.frame)
+        self.assertEqual(self.store.load(), 0)
+        self.assertTrue(np.array_equal(self.store.imread(self.pic), self.im))
+
+
+if __name__ == "__main__":
+    unittest.main()
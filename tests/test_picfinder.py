@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+>> python -m unittest discover tests        from the top of the repo
+"""
+import os
+import re
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+from itertools import permutations
+import numpy as np
+import cv2
+import picfinder as pf
+
+
+def brute_force(cost):
+    """ the lowest total cost over every possible assignment """
+    n = len(cost)
+    return min(sum(cost[r][c] for r, c in enumerate(cols)) for cols in permutations(xrange(n)))
+
+
+class MinCostAssignmentTest(unittest.TestCase):
+    def check(self, cost):
+        picks = pf.min_cost_assignment(cost)
+        self.assertEqual(sorted(picks), range(len(cost)))      # every column used exactly once
+        self.assertEqual(sum(cost[r][c] for r, c in enumerate(picks)), brute_force(cost))
+
+    def test_random_squares(self):
+        rnd = random.Random(1993)
+        for n in xrange(1, 7):
+            for _ in xrange(40):
+                self.check([[rnd.randint(0, 9) for _ in xrange(n)] for _ in xrange(n)])
+
+    def test_greedy_would_lose(self):
+        # row 0 grabbing its cheapest column (0) forces row 1 onto a cost of 100
+        cost = [[1, 2], [1, 100]]
+        self.assertEqual(pf.min_cost_assignment(cost), [1, 0])
+
+    def test_padded_with_limit(self):
+        # leven_matches() pads a non-square problem out with 'limit', which stands for "no match"
+        rnd, limit = random.Random(5), pf.__leven_limit__
+        for rows, cols in [(2, 5), (5, 2), (3, 4), (4, 1), (1, 4)]:
+            for _ in xrange(40):
+                size = max(rows, cols)
+                cost = [[limit] * size for _ in xrange(size)]
+                for r in xrange(rows):
+                    for c in xrange(cols):
+                        cost[r][c] = rnd.choice([rnd.randint(0, limit - 1), limit])
+                self.check(cost)
+                picks = pf.min_cost_assignment(cost)
+                real = [(r, c) for r, c in enumerate(picks) if r < rows and c < cols and cost[r][c] < limit]
+                # as many real (below the limit) pairs as the best assignment can manage
+                self.assertEqual(sum(limit - cost[r][c] for r, c in real),
+                                 size * limit - brute_force(cost))
+
+
+class LevenMatchesTest(unittest.TestCase):
+    def test_better_claim_wins(self):
+        # both names are within reach of 'fireball', but 'firebal' is the closer one and should get it
+        names = [u'Fire Bolt', u'Firebal']
+        revlinks = {pf.normal_name(u'Fireball'): ['http://x/1.html'], pf.normal_name(u'Firebolt'): ['http://x/2.html']}
+        found = dict((names[n], url) for n, url, _, _ in pf.leven_matches(names, revlinks))
+        self.assertEqual(found, {u'Firebal': 'http://x/1.html', u'Fire Bolt': 'http://x/2.html'})
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves the one picture in 'body' at any path, honouring 'Range: bytes=N-' like a real web server """
+    body, asked = '', []
+
+    def do_GET(self):
+        self.asked.append(self.headers.get('Range'))
+        start = int(re.match(r'bytes=(\d+)-', self.headers.get('Range', 'bytes=0-')).group(1))
+        if start >= len(self.body):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(len(self.body)))
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(self.body) - 1, len(self.body)))
+        self.send_header('Content-Length', str(len(self.body) - start))
+        self.end_headers()
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.part = os.path.join(self.folder, 'pic.jpg' + pf.__part__)
+        im = np.random.RandomState(7).randint(0, 255, (60, 40, 3)).astype(np.uint8)
+        RangeHandler.body, RangeHandler.asked = cv2.imencode('.jpg', im)[1].tostring(), []
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.url = 'http://127.0.0.1:{}/pic.jpg'.format(self.server.server_address[1])
+        worker = threading.Thread(target=self.server.serve_forever)
+        worker.daemon = True
+        worker.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def download(self):
+        """ one picture through the same window download_queue() uses """
+        return list(pf.peep.window_getter([self.url], tries=2, backoff=0, DBG=False, ok=pf.__dl_ok__,
+                                          get=lambda url, session: pf.fetch_pic(url, self.part, session)))
+
+    def test_resumes_truncated(self):
+        cut = len(RangeHandler.body) // 3
+        with open(self.part, 'wb') as fob:
+            fob.write(RangeHandler.body[:cut])
+        [(url, rsp)] = self.download()
+        self.assertEqual(rsp.status_code, 206)
+        self.assertEqual(RangeHandler.asked, ['bytes={}-'.format(cut)])     # asked once, for the rest only
+        self.assertIsNone(pf.verify_pic(self.part, rsp.expected))
+        with open(self.part, 'rb') as fob:
+            self.assertEqual(fob.read(), RangeHandler.body)
+
+    def test_fresh(self):
+        [(url, rsp)] = self.download()
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(RangeHandler.asked, [None])
+        self.assertIsNone(pf.verify_pic(self.part, rsp.expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
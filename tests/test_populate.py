@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+>> python -m unittest discover tests        from the top of the repo
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import requests
+import populate as peep
+
+
+class WindowGetterTest(unittest.TestCase):
+    def test_no_wait_after_last_try(self):
+        calls = []
+
+        def dead(url, session):
+            calls.append(time.time())
+            raise requests.ConnectionError("nobody home")
+
+        start = time.time()
+        [(url, rsp)] = list(peep.window_getter(['http://dead.invalid/'], tries=3, backoff=0.2, DBG=False, get=dead))
+        done = time.time()
+        self.assertIsNone(rsp)
+        self.assertEqual(len(calls), 3)
+        self.assertGreaterEqual(calls[-1] - start, 0.55)    # waited 0.2 s and 0.4 s between the tries...
+        self.assertLess(done - calls[-1], 0.3)              # ...but not the 0.8 s that would follow a 4th
+
+    def test_answer_stops_retrying(self):
+        calls = []
+
+        def missing(url, session):
+            calls.append(url)
+            rsp = requests.Response()
+            rsp.status_code = 404
+            return rsp
+
+        [(url, rsp)] = list(peep.window_getter(['http://x/'], tries=3, backoff=0, DBG=False, get=missing))
+        self.assertEqual((rsp.status_code, len(calls)), (404, 1))
+
+
+class BuildIndexesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def indexes(self, db):
+        return set(r[0] for r in db.cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"))
+
+    def test_partial_waits_for_its_columns(self):
+        db = peep.DBMagic(DBfn=os.path.join(self.folder, 'x.sqlite'),
+                          DBcolumns={'t': 'CREATE TABLE t (id TEXT PRIMARY KEY, a TEXT, kind TEXT)'},
+                          DBindexes={'t': ["a WHERE kind = 'foo bar' OR kind = 'it''s'", 'kind WHERE b IS NULL']})
+        self.assertEqual(self.indexes(db), {'idx_t_a_partial'})     # the quoted words aren't columns to wait for
+        db.add_columns('t', {'b': 'TEXT'})
+        self.assertEqual(self.indexes(db), {'idx_t_a_partial', 'idx_t_kind_partial'})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python -S
+# -*- coding: utf-8 -*-
+"""
+a shared on-disk cache of web pages for all the scrapers (populate, picfinder, pricer).
+Each url's last good response is kept under /webcache/ along with its ETag / Last-Modified headers.
+Later requests for that url are sent as conditional requests, and a '304 Not Modified' gets served from disk.
+
+Two switches (environment variables) help with benchmarks and with cutting bandwidth:
+CARDSNAKE_OFFLINE=1  replay mode: everything comes from the cache, nothing goes out over the network
+CARDSNAKE_STAND_IN=http://localhost:8000  send every request to a local stand-in server instead of the real sites.
+    'python webcache.py 8000' runs a stand-in that serves the cached pages, so the whole 'popu_pic_orient.py'
+    pipeline can be run against it.
+Pictures aren't cached here (/pics/ is their cache), so neither switch can supply them: they stay queued for download.
+"""
+import os
+import json
+import time
+import hashlib
+import requests
+from requests.structures import CaseInsensitiveDict
+from urlparse import urlparse, urlunparse
+import BaseHTTPServer
+import SocketServer
+import sys
+
+__cachedir__ = os.getcwd() + os.sep + 'webcache'
+__offline__ = bool(os.environ.get('CARDSNAKE_OFFLINE'))
+__stand_in__ = os.environ.get('CARDSNAKE_STAND_IN')
+__kept_headers__ = ['ETag', 'Last-Modified', 'Content-Type']
+
+
+def cache_paths(url, cachedir=__cachedir__):
+    """ returns (local path of the cached body, local path of its json headers file) for a url """
+    stem = os.path.join(cachedir, hashlib.sha1(url).hexdigest())
+    return stem + '.body', stem + '.json'
+
+
+def load(url):
+    """ returns (meta-data dict, body string) of the cached response for url, or (None, None) """
+    body_fn, meta_fn = cache_paths(url)
+    try:
+        with open(meta_fn, 'rb') as fob:
+            meta = json.load(fob)
+        with open(body_fn, 'rb') as fob:
+            return meta, fob.read()
+    except (IOError, ValueError):
+        return None, None
+
+
+def store(url, rsp):
+    """ save a good response to disk. The files are written aside then renamed, so readers never see half """
+    if not os.path.isdir(__cachedir__):
+        os.makedirs(__cachedir__)
+    meta = {'url': url, 'status': rsp.status_code, 'encoding': rsp.encoding, 'fetched': time.time(),
+            'headers': {h: rsp.headers[h] for h in __kept_headers__ if h in rsp.headers}}
+    for fn, stuff in zip(cache_paths(url), [rsp.content, json.dumps(meta)]):
+        with open(fn + '.tmp', 'wb') as fob:
+            fob.write(stuff)
+        if os.path.isfile(fn) and 'nt' in os.name:
+            os.remove(fn)
+        os.rename(fn + '.tmp', fn)
+    return meta
+
+
+def replay(url, meta, body, status=None):
+    """ dress up cached stuff as a requests.Response, so .json(), .content and .iter_lines() all work """
+    rsp = requests.models.Response()
+    rsp._content = body
+    rsp._content_consumed = True
+    rsp.status_code = status or meta.get('status', 200)
+    rsp.headers = CaseInsensitiveDict(meta.get('headers', {}))
+    rsp.encoding = meta.get('encoding')
+    rsp.url = url
+    return rsp
+
+
+def stand_in(url, base=None):
+    """
+    'http://mtgjson.com/json/LEA.json' becomes 'http://localhost:8000/http/mtgjson.com/json/LEA.json'
+    when base='http://localhost:8000'. No base, no change.
+    """
+    if base is None:
+        base = __stand_in__
+    if not base:
+        return url
+    u, b = urlparse(url), urlparse(base)
+    return urlunparse((b.scheme, b.netloc, '/'.join([b.path.rstrip('/'), u.scheme, u.netloc + u.path]),
+                       u.params, u.query, ''))
+
+
+def get(url, session=None, **kwargs):
+    """
+    use in place of requests.get(url). Sends a conditional request when the url is cached,
+    and answers a '304' with the cached copy, so callers still just see a status_code of 200.
+    session: anything with a requests-style .get(), eg a requests.Session()
+    """
+    meta, body = load(url)
+    if __offline__:
+        if meta is None:
+            print("offline, and nothing cached for: {}".format(url))
+            return replay(url, {}, '', status=504)
+        return replay(url, meta, body)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if meta is not None:
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+    rsp = (session or requests).get(stand_in(url), headers=headers, **kwargs)
+    if rsp.status_code == 304 and meta is not None:
+        return replay(url, meta, body)
+    if rsp.status_code == 200:
+        store(url, rsp)
+        rsp.url = url
+    return rsp
+
+
+class StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves cached pages to urls made by stand_in(), honoring If-None-Match with a '304' """
+    def do_GET(self):
+        scheme, rest = self.path.lstrip('/').split('/', 1)
+        meta, body = load(scheme + '://' + rest)
+        if meta is None:
+            self.send_error(404)
+            return
+        headers = dict(meta['headers'])
+        headers.setdefault('ETag', '"{}"'.format(hashlib.sha1(body).hexdigest()))
+        if self.headers.get('If-None-Match') == headers['ETag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        for h, v in headers.viewitems():
+            self.send_header(h, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def serve(port=8000):
+    print("serving {} as a stand-in web server at http://localhost:{}".format(__cachedir__, port))
+    ThreadedServer(('', port), StandIn).serve_forever()
+
+
+if __name__ == "__main__":
+    exit(serve(*[int(a) for a in sys.argv[1:2]]))